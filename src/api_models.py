@@ -3,7 +3,14 @@ from typing import List, Optional
 import datetime
 import requests
 import os
-import json
+from daily_files import write_grouped_daily
+
+DEFAULT_ENDPOINT = "https://api.polygon.io"
+
+
+def polygon_endpoint():
+    # POLYGON_BASE_URL points the requests at another server, e.g. mock_polygon.py
+    return os.environ.get("POLYGON_BASE_URL") or DEFAULT_ENDPOINT
 
 
 class Ticker(BaseModel):
@@ -28,57 +35,63 @@ class TickerListResponse(BaseModel):
 
 
 class TickerListRequest:
-    def __init__(self,api_key:str,page_num:int,cursor,outdir):
-        self.cursor=cursor
+    # one page of /v3/reference/tickers, the first page of a shard is built from its filters and
+    # later pages from the next_url cursor; fetch() makes the call, so requests can be retried
+    def __init__(self,api_key:str,cursor=None,market=None,ticker_type=None,session=None,limit=1000,endpoint=None):
+        self.cursor = cursor
         self.api_key = api_key
-        self.page_num = page_num
-        self.limit = 1000
-        self.endpoint = "https://api.polygon.io"
+        self.limit = limit
+        self.endpoint = (endpoint or polygon_endpoint()).rstrip("/")
+        # a shared session pools connections and handles rate limiting/retries
+        self.session = session if session is not None else requests
+        self.params = {"limit":limit,"apiKey":api_key}
         if cursor:
-            self.query = cursor + f"&limit={1000}&apiKey={api_key}"
+            # next_url already carries the cursor and the shard filters, but not the key
+            self.query = cursor
         else:
-            self.query = self.endpoint + f"/v3/reference/tickers?limit={1000}&apiKey={api_key}"
-
-        self.response = requests.get(self.query)
-        # saving response
-        self.data = self.response.json()
-        with open(os.path.join(outdir,f"response_page{page_num}.json"),"w") as outfile:
-            json.dump(self.data,outfile,indent=4)
-        with open(os.path.join(outdir,f"ticker_page{page_num}.json"),"w") as outfile:
-            json.dump(self.data["results"],outfile,indent=4)
+            self.query = self.endpoint + "/v3/reference/tickers"
+            if market:
+                self.params["market"] = market
+            if ticker_type:
+                self.params["type"] = ticker_type
+        self.data = None
+
+    def fetch(self):
+        response = self.session.get(self.query,params=self.params)
+        response.raise_for_status()
+        # a truncated body fails here rather than being taken for the last page
+        self.data = response.json()
+        if "results" not in self.data:
+            raise ValueError(f"Response without results: {self.data.get('status')}")
+        return self.data["results"]
 
     def get_next_cursor(self):
         # if there is a next page, return
-        if "next_url" in self.data:
-            return self.data["next_url"]
-        else:
-            return None
+        return self.data.get("next_url")
 
     def validate(self):
         pass
 
 class GroupedDailyRequest:
-    def __init__(self,date,api_key:str,outdir):
+    def __init__(self,date,api_key:str,outdir,session=None,storage_format="parquet",endpoint=None):
         self.api_key = api_key
-        self.endpoint = "https://api.polygon.io"
+        self.endpoint = (endpoint or polygon_endpoint()).rstrip("/")
         self.query = self.endpoint + f"/v2/aggs/grouped/locale/us/market/stocks/{date}?include_otc=true&apiKey={api_key}"
+        # a shared session pools connections and handles rate limiting/retries
+        self.session = session if session is not None else requests
+        self.ok = False
+        self.path = None
 
         try:
-            self.response = requests.get(self.query)
+            self.response = self.session.get(self.query)
+            self.response.raise_for_status()
             # saving response
-            self.data = self.response.json()
-            with open(os.path.join(outdir,f"{date}_full.json"),"w") as outfile:
-                json.dump(self.data,outfile,indent=4)
-            with open(os.path.join(outdir,f"{date}.json"),"w") as outfile:
-                if self.data["resultsCount"] != 0:
-                    json.dump(self.data["results"],outfile,indent=4)
-                else:
-                    json.dump([{}],outfile,indent=4)
+            data = self.response.json()
+            self.path = write_grouped_daily(data,outdir,date,storage_format)
+            # keep only the small envelope, the results now live on disk
+            data.pop("results",None)
+            self.data = data
+            self.ok = True
 
         except Exception as err:
             print(err)
-
-
-
-
-
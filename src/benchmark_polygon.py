@@ -0,0 +1,99 @@
+"""
+End-to-end throughput of the polygon fetch scripts against mock_polygon.py
+Runs get_grouped_daily and get_ticker_reference unchanged, in a scratch data folder,
+with the mock on a local port, and reports days/minute, pages/minute and the
+429/truncation counts the fetcher had to absorb
+
+Run from src/, e.g.
+    python benchmark_polygon.py --days 60 --workers 8 --rpm 600 --latency 0.2 --error-rate 0.05
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import requests
+
+from mock_polygon import MockPolygon, serve
+from trading_calendar import previous_trading_days
+
+
+def run_stage(name,fn,base_url):
+    before = requests.get(f"{base_url}/stats").json()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter()-start
+    after = requests.get(f"{base_url}/stats").json()
+    delta = {key: after[key]-before[key] for key in after}
+    return {"stage":name,"seconds":seconds,**delta}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the fetch scripts against a mock polygon API")
+    parser.add_argument("--days",type=int,default=30,help="trading days of grouped daily to fetch")
+    parser.add_argument("--tickers",type=int,default=5000,help="bars per grouped daily response")
+    parser.add_argument("--reference-tickers",type=int,default=3000,help="reference tickers per market")
+    parser.add_argument("--workers",type=int,default=4)
+    parser.add_argument("--rpm",type=float,default=600,help="client rate limit in requests per minute")
+    parser.add_argument("--latency",type=float,default=0.1)
+    parser.add_argument("--jitter",type=float,default=0.05)
+    parser.add_argument("--error-rate",type=float,default=0.0)
+    parser.add_argument("--truncate-rate",type=float,default=0.0)
+    parser.add_argument("--retry-after",type=float,default=0.5)
+    parser.add_argument("--format",choices=["parquet","json"],default="parquet",help="grouped daily file format")
+    parser.add_argument("--skip-tickers",action="store_true",help="only benchmark get_grouped_daily")
+    parser.add_argument("--out",help="file to write the results as json")
+    args = parser.parse_args()
+
+    mock = MockPolygon(args.tickers,args.reference_tickers,args.latency,args.jitter,args.error_rate,
+                       args.truncate_rate,args.retry_after)
+    server, base_url = serve(mock)
+    data_folder = tempfile.mkdtemp(prefix="polygon_benchmark_")
+    yesterday = datetime.date.today()-datetime.timedelta(days=1)
+    # set before the scripts run, load_dotenv does not override them
+    os.environ.update({
+        "POLYGON_BASE_URL":base_url,
+        "API_KEY":"mock",
+        "DATA_FOLDER":data_folder,
+        "START_DATE":previous_trading_days(yesterday,args.days)[0].isoformat(),
+        "REQUESTS_PER_MINUTE":str(args.rpm),
+        "MAX_WORKERS":str(args.workers),
+        "MANIFEST_BACKEND":"local",
+        "GROUPED_DAILY_FORMAT":args.format,
+        "STORAGE_BACKEND":"sqlite",
+        # one file per written page, so pages are counted on the client side
+        "TICKER_SINK":"parquet",
+    })
+    os.environ.pop("MANIFEST_CACHE",None)
+    os.environ.pop("TICKER_SHARDS",None)
+
+    from get_grouped_daily import get_grouped_daily
+    from get_ticker_reference import get_ticker_reference
+    results = []
+    try:
+        results.append(run_stage("grouped_daily",get_grouped_daily,base_url))
+        fetched = len(os.listdir(os.path.join(data_folder,"grouped_daily_json")))
+        results[0]["days_per_min"] = fetched/results[0]["seconds"]*60
+        results[0]["days_fetched"] = fetched
+        if not args.skip_tickers:
+            results.append(run_stage("ticker_reference",get_ticker_reference,base_url))
+            # the mock's request counter includes retried 429s and truncated bodies, the sink does not
+            pages = len(os.listdir(os.path.join(data_folder,"ticker_reference","tickers")))
+            results[1]["pages_per_min"] = pages/results[1]["seconds"]*60
+            results[1]["pages_written"] = pages
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(data_folder,ignore_errors=True)
+
+    for result in results:
+        print(", ".join(f"{key}={value:.2f}" if isinstance(value,float) else f"{key}={value}" for key, value in result.items()))
+    if args.out:
+        with open(args.out,"w") as f:
+            json.dump({"args":vars(args),"results":results},f,indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,22 @@ from google.cloud import bigquery
 from pathlib import Path
 import os
 import json
-import pandas as pd
-import sqlite3
+import argparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
+from daily_store import get_store
+
+BQ_TO_ARROW = {
+    "DATE":pa.date32(),
+    "STRING":pa.string(),
+    "FLOAT64":pa.float64(),
+    "INT64":pa.int64(),
+    "TIMESTAMP":pa.timestamp("us",tz="UTC"),
+}
+KEY_COLS = ["date","ticker","run_id"]
+PARTITION_FIELD = "date"
 
 def dataset_exists(client,dataset_id):
     try:
@@ -28,48 +41,124 @@ def create_dataset(client,dataset_id):
     dataset = client.create_dataset(dataset,timeout=30)
     print(f"Created dataset {dataset_id}")
 
-def load_data(schema_path,conn,sql_path):
-    # load data from database into json format
+def arrow_schema(schema_path):
     with open(schema_path) as f:
         schema = json.load(f)
-    
-    cols = [item["name"] for item in schema]
-    data_types = [item["type"] for item in schema]
-    cols_types = zip(cols,data_types)
+    return pa.schema([(item["name"],BQ_TO_ARROW[item["type"]]) for item in schema])
 
-    with open(sql_path,"r") as sql:
-        df = pd.read_sql_query(sql.read(),conn)
+def to_arrow(batch,schema):
+    # cast one store batch to the bigquery column types, "YYYY-MM-DD" and ISO timestamps parse in arrow
+    arrays = []
+    for field in schema:
+        column = batch.column(field.name)
+        if pa.types.is_integer(field.type) and pa.types.is_floating(column.type):
+            column = pc.round(column)
+        arrays.append(pc.cast(column,field.type))
+    return pa.RecordBatch.from_arrays(arrays,schema=schema)
 
-    df = df[cols]
-    for col, type in cols_types:
-        if type == "DATE":
-            df[col] = pd.to_datetime(df[col])
+def stage_parquet(store,schema,path,table_name="small_daily",since=None,batch_rows=50000):
+    # stream the store rows chunk by chunk into one parquet file, memory stays at one batch;
+    # since keeps only rows published after that timestamp
+    filters = [("published_at",">",since)] if since is not None else None
+    rows = 0
+    with pq.ParquetWriter(path,schema,compression="zstd") as writer:
+        for batch in store.iter_table(table_name,columns=schema.names,filters=filters,batch_rows=batch_rows):
+            writer.write_batch(to_arrow(batch,schema))
+            rows += batch.num_rows
+    return rows
 
-    return df
+def is_partitioned(client,table_id):
+    partitioning = client.get_table(table_id).time_partitioning
+    return partitioning is not None and partitioning.field == PARTITION_FIELD
 
-def create_or_overwrite_table(df, client,table_id,schema_path):
-    schema = client.schema_from_json(schema_path)
-    job_config = bigquery.LoadJobConfig(schema=schema,
-                                        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+def last_published(client,table_id):
+    # newest published_at already in bigquery, None when the table predates run_id/published_at
+    table = client.get_table(table_id)
+    if "published_at" not in [field.name for field in table.schema]:
+        return None
+    rows = list(client.query(f"SELECT MAX(published_at) AS since FROM `{table_id}`").result())
+    since = rows[0]["since"] if rows else None
+    return since.isoformat() if since is not None else None
+
+def load_staged(client,path,table_id,schema_path,write_disposition):
+    # one load job from the staged file into a table partitioned by date
+    job_config = bigquery.LoadJobConfig(schema=client.schema_from_json(schema_path),
+                                        source_format=bigquery.SourceFormat.PARQUET,
+                                        write_disposition=write_disposition,
+                                        time_partitioning=bigquery.TimePartitioning(
+                                            type_=bigquery.TimePartitioningType.DAY,field=PARTITION_FIELD)
                                         )
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+    with open(path,"rb") as f:
+        job = client.load_table_from_file(f,table_id,job_config=job_config)
     job.result()
-    print(f"Loaded table {table_id}")
+    return job.output_rows
+
+def merge_table(client,path,table_id,schema_path,key_cols):
+    # load the new rows into a staging table, then upsert them by key_cols with one MERGE
+    staging_id = f"{table_id}_staging"
+    load_staged(client,path,staging_id,schema_path,bigquery.WriteDisposition.WRITE_TRUNCATE)
+    cols = arrow_schema(schema_path).names
+    on = " AND ".join(f"T.{col} = S.{col}" for col in key_cols)
+    update = ", ".join(f"{col} = S.{col}" for col in cols if col not in key_cols)
+    query = (
+        f"MERGE `{table_id}` T USING `{staging_id}` S ON {on}"
+        f" WHEN MATCHED THEN UPDATE SET {update}"
+        f" WHEN NOT MATCHED THEN INSERT ({', '.join(cols)}) VALUES ({', '.join('S.'+col for col in cols)})"
+    )
+    client.query(query).result()
+    client.delete_table(staging_id,not_found_ok=True)
+
+def publish(client,store,table_id,schema_path,staging_folder,write_mode="merge",table_name="small_daily",batch_rows=50000):
+    # "merge" and "append" ship only rows published since the last load, "truncate" reloads everything;
+    # a table from the old unpartitioned loader gets one full reload
+    exists = table_exists(client,table_id)
+    partitioned = exists and is_partitioned(client,table_id)
+    since = last_published(client,table_id) if write_mode != "truncate" and partitioned else None
+
+    path = os.path.join(staging_folder,f"{table_name}_staging.parquet")
+    rows = stage_parquet(store,arrow_schema(schema_path),path,table_name,since,batch_rows)
+    try:
+        if since is None:
+            if exists and not partitioned:
+                # bigquery can't change the partitioning of an existing table
+                client.delete_table(table_id)
+            load_staged(client,path,table_id,schema_path,bigquery.WriteDisposition.WRITE_TRUNCATE)
+            print(f"Loaded {rows} rows into {table_id}")
+        elif rows == 0:
+            print(f"No new rows for {table_id}")
+        elif write_mode == "append":
+            # cheapest path, but a rerun of the same day appends its rows again
+            load_staged(client,path,table_id,schema_path,bigquery.WriteDisposition.WRITE_APPEND)
+            print(f"Appended {rows} rows to {table_id}")
+        else:
+            merge_table(client,path,table_id,schema_path,KEY_COLS)
+            print(f"Merged {rows} rows into {table_id}")
+    finally:
+        os.remove(path)
+    return rows
+
+def make_client(fake=False):
+    if fake:
+        from fake_bigquery import FakeClient
+        return FakeClient()
+    return bigquery.Client()
 
 
-def main():
+def main(fake=False,client=None,store=None):
+    # client and store can be shared with other stages (see pipeline.py), the store is only closed when opened here
     print("Start BigQuery")
     script_folder = Path(__file__).resolve().parent
     bq_schemas_folder = os.path.join(script_folder,"bq_schemas")
-    sql_scripts_folder = os.path.join(script_folder,"sql_scripts")
 
     env_path = os.path.join(script_folder.parent,".env")
     load_dotenv(env_path)
     data_folder = os.environ.get("DATA_FOLDER")
-    db_file = os.path.join(data_folder,"stock.db")
-    conn = sqlite3.connect(db_file)
+    own_store = store is None
+    if own_store:
+        store = get_store(data_folder)
 
-    client = bigquery.Client()
+    if client is None:
+        client = make_client(fake)
     dataset_name = "stock_dataset"
     small_daily_table_name = "small_daily"
     dataset_id = f"{client.project}.{dataset_name}"
@@ -79,15 +168,19 @@ def main():
         print(f"Dataset {dataset_name} does not exist")
         create_dataset(client,dataset_id)
 
-    # load/overwrite small_daily table
+    # load/update small_daily table
     small_daily_schema_path = os.path.join(bq_schemas_folder,"small_daily.json")
-    sql_path = os.path.join(sql_scripts_folder,"query_small_daily.sql")
-    df = load_data(small_daily_schema_path,conn,sql_path)
-    create_or_overwrite_table(df, client,small_daily_table_id,small_daily_schema_path)
+    publish(client,store,small_daily_table_id,small_daily_schema_path,data_folder,
+            write_mode=os.environ.get("BQ_WRITE_MODE","merge"))
+    if own_store:
+        store.close()
     print("End BigQuery")
     
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="publish small_daily to BigQuery")
+    parser.add_argument("--fake",action="store_true",help="publish into an in-memory client instead of BigQuery")
+    args = parser.parse_args()
+    main(fake=args.fake)
     
 
     
\ No newline at end of file
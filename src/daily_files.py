@@ -0,0 +1,75 @@
+"""
+Read/write grouped daily responses
+"parquet" stores one compact columnar file per day with the response envelope
+kept as file metadata, "json" keeps the legacy {date}.json + {date}_full.json pair
+"""
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+GROUPED_DAILY_SCHEMA = pa.schema([
+    ("T",pa.string()),
+    ("o",pa.float64()),
+    ("c",pa.float64()),
+    ("h",pa.float64()),
+    ("l",pa.float64()),
+    ("n",pa.int64()),
+    ("v",pa.float64()),
+    ("vw",pa.float64()),
+    ("otc",pa.bool_()),
+    ("t",pa.int64()),
+])
+ENVELOPE_KEY = b"polygon_envelope"
+SUFFIXES = (".parquet",".json")
+
+
+def is_grouped_daily_file(file):
+    return file.endswith(SUFFIXES) and "full" not in file
+
+
+def write_grouped_daily(data,outdir,date,storage_format="parquet"):
+    # returns the path of the written day file
+    if storage_format == "json":
+        with open(os.path.join(outdir,f"{date}_full.json"),"w") as outfile:
+            json.dump(data,outfile,indent=4)
+        path = os.path.join(outdir,f"{date}.json")
+        with open(path,"w") as outfile:
+            if data["resultsCount"] != 0:
+                json.dump(data["results"],outfile,indent=4)
+            else:
+                json.dump([{}],outfile,indent=4)
+        return path
+
+    if storage_format != "parquet":
+        raise ValueError(f"Unknown storage format: {storage_format}")
+    # the envelope is small, everything but the results goes into metadata
+    envelope = {key: value for key, value in data.items() if key != "results"}
+    table = pa.Table.from_pylist(data.get("results") or [],schema=GROUPED_DAILY_SCHEMA)
+    table = table.replace_schema_metadata({ENVELOPE_KEY: json.dumps(envelope)})
+    path = os.path.join(outdir,f"{date}.parquet")
+    pq.write_table(table,path,compression="zstd")
+    return path
+
+
+def read_grouped_daily(path,as_arrow=False):
+    # returns a frame (or arrow table) with polygon's short column names, empty if the day has no results
+    if path.endswith(".parquet"):
+        table = pq.read_table(path)
+        return table if as_arrow else table.to_pandas()
+    df = pd.read_json(path)
+    if len(df.columns) == 0:
+        df = df.iloc[0:0]
+    return pa.Table.from_pandas(df,preserve_index=False) if as_arrow else df
+
+
+def read_envelope(path):
+    if path.endswith(".parquet"):
+        metadata = pq.read_schema(path).metadata or {}
+        return json.loads(metadata.get(ENVELOPE_KEY,b"{}"))
+    full_path = path[:-len(".json")] + "_full.json"
+    with open(full_path,"r") as f:
+        data = json.load(f)
+    data.pop("results",None)
+    return data
@@ -0,0 +1,595 @@
+"""
+Storage backends for daily bars, the ETL ledger and the small output tables
+"sqlite" keeps everything in stock.db, "parquet" stores daily bars as
+date-partitioned Parquet files (local folder or gs:// root) so a run only
+reads and writes the partitions it touches, "duckdb" is "parquet" queried with DuckDB
+"""
+import os
+import json
+import time
+import datetime
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from trading_calendar import epoch_day, from_epoch_day
+
+DAILY_COLUMNS = [
+    "date"
+    , "ticker"
+    , "open_price"
+    , "close_price"
+    , "highest_price"
+    , "lowest_price"
+    , "number_of_transactions"
+    , "trading_volume"
+    , "volume_weighted_average_price"
+    , "otc_sticker"
+    , "window_start_timestamp"
+]
+
+# applied on every sqlite connection, override through SQLiteStore(pragmas=...)
+DEFAULT_PRAGMAS = {
+    "journal_mode":"WAL"
+    , "synchronous":"NORMAL"
+    , "cache_size":-65536  # negative means KiB, i.e. 64MB
+    , "temp_store":"MEMORY"
+}
+
+
+def get_store(data_folder,backend=None):
+    backend = backend or os.environ.get("STORAGE_BACKEND","sqlite")
+    if backend == "sqlite":
+        return SQLiteStore(os.path.join(data_folder,"stock.db"))
+    if backend in ("parquet","duckdb"):
+        root = os.environ.get("PARQUET_ROOT") or os.path.join(data_folder,"store")
+        return ParquetStore(root,use_duckdb=backend == "duckdb")
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+class DailyStore(ABC):
+    daily_tablename = "daily"
+
+    def create_table(self,sql_script):
+        pass
+
+    def migrate(self):
+        return False
+
+    @abstractmethod
+    def loaded_files(self,tablename):
+        # file -> checksum of everything already ingested into tablename
+        pass
+
+    @abstractmethod
+    def load(self,tablename,items,key_cols):
+        # items yields (file, checksum, date, arrow table) and each file is recorded in the ledger
+        pass
+
+    @abstractmethod
+    @contextmanager
+    def rebuild(self,tablename):
+        # empty tablename and its ledger entries for a full reload
+        pass
+
+    @abstractmethod
+    def read_daily(self,tickers=None,start=None,end=None,columns=None):
+        # daily bars with "YYYY-MM-DD" dates, optionally filtered by ticker and [start, end]
+        pass
+
+    @abstractmethod
+    def iter_daily(self,tickers=None,start=None,end=None,columns=None,batch_rows=100000):
+        # read_daily streamed as arrow record batches, date comes as date32
+        pass
+
+    @abstractmethod
+    def daily_bounds(self):
+        # ("YYYY-MM-DD", "YYYY-MM-DD") first and last date in daily, (None, None) when empty
+        pass
+
+    @abstractmethod
+    def read_table(self,name,columns=None,filters=None):
+        # filters: [(column, op, value), ...] combined with AND, op one of = == != < <= > >=
+        pass
+
+    @abstractmethod
+    def iter_table(self,name,columns=None,filters=None,batch_rows=50000):
+        # same rows as read_table streamed as arrow record batches of up to batch_rows rows
+        pass
+
+    @abstractmethod
+    def write_table(self,name,df):
+        # replace a small output table
+        pass
+
+    @abstractmethod
+    def upsert_table(self,name,df,key_cols,replace=False):
+        # insert or update rows of an output table such as small_daily by key_cols,
+        # replace=True empties the table first
+        pass
+
+    @abstractmethod
+    def max_value(self,name,column,filters=None):
+        # max of column over the filtered rows, None if the table or column doesn't exist yet
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStore(DailyStore):
+    ledger_tablename = "etl_ledger"
+
+    def __init__(self,db_file,sql_scripts=None,pragmas=None,batch_rows=200000):
+        self.db_file = db_file
+        self.sql_scripts = sql_scripts or os.path.join(Path(__file__).resolve().parent,"sql_scripts")
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        # rows per transaction in bulk loads
+        self.batch_rows = batch_rows
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # one store is shared by the pipeline stages and the ticker shard threads, callers serialize writes
+            self._conn = sqlite3.connect(self.db_file,check_same_thread=False)
+            for pragma, value in self.pragmas.items():
+                self._conn.execute(f"PRAGMA {pragma}={value}")
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def create_table(self,sql_script):
+        with open(os.path.join(self.sql_scripts,sql_script),"r") as f:
+            self.conn.executescript(f.read())
+        self.conn.commit()
+
+    def table_columns(self,tablename):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({tablename})")]
+
+    def date_type(self):
+        # declared type of daily.date, None if the table doesn't exist yet
+        for row in self.conn.execute(f"PRAGMA table_info({self.daily_tablename})"):
+            if row[1] == "date":
+                return row[2].upper()
+        return None
+
+    def migrate(self):
+        # convert a TEXT-date daily table in place to the typed layout of create_daily.sql
+        date_type = self.date_type()
+        if date_type is None or date_type == "INTEGER":
+            return False
+        print("Migrating daily table to the typed schema")
+        start = time.perf_counter()
+        with open(os.path.join(self.sql_scripts,"create_daily.sql"),"r") as f:
+            create_sql = f.read()
+        with open(os.path.join(self.sql_scripts,"migrate_daily.sql"),"r") as f:
+            migrate_sql = f.read()
+        try:
+            self.conn.executescript(
+                f"BEGIN;\nALTER TABLE {self.daily_tablename} RENAME TO daily_old;\n"
+                + create_sql + ";\n" + migrate_sql + "\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        # reclaim the space of the old table
+        self.conn.execute("VACUUM")
+        print(f"Migrated daily table in {time.perf_counter()-start:.2f}s")
+        return True
+
+    def upsert_statement(self,tablename,columns,key_cols):
+        # INSERT ... ON CONFLICT DO UPDATE, so reloading a file never duplicates or drops rows
+        table_cols = self.table_columns(tablename)
+        cols = [col for col in columns if col in table_cols]
+        update_cols = [col for col in cols if col not in key_cols]
+        sql = (
+            f"INSERT INTO {tablename} ({','.join(cols)}) VALUES ({','.join('?'*len(cols))})"
+            f" ON CONFLICT({','.join(key_cols)}) DO UPDATE SET "
+            + ",".join(f"{col}=excluded.{col}" for col in update_cols)
+        )
+        return sql, cols
+
+    def loaded_files(self,tablename):
+        self.create_table("create_etl_ledger.sql")
+        rows = self.conn.execute(f"SELECT file, checksum FROM {self.ledger_tablename} WHERE tablename = ?",(tablename,))
+        return dict(rows.fetchall())
+
+    def record_file(self,tablename,file,checksum,row_count,date=None):
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {self.ledger_tablename} (file,tablename,date,checksum,row_count,loaded_at) VALUES (?,?,?,?,?,?)",
+            (Path(file).name,tablename,date,checksum,row_count,utc_now())
+        )
+
+    def load(self,tablename,items,key_cols):
+        # rows and ledger entries commit together once every self.batch_rows rows,
+        # so a failure never leaves a file half-recorded
+        if tablename == self.daily_tablename and self.date_type() != "INTEGER":
+            raise RuntimeError("daily table uses the old TEXT date schema, run migrate first")
+        self.create_table("create_etl_ledger.sql")
+        statements = {}
+        total_rows = 0
+        batch_rows = 0
+        start = time.perf_counter()
+        for file, checksum, date, table in items:
+            if table.num_rows > 0:
+                columns = tuple(table.column_names)
+                if columns not in statements:
+                    statements[columns] = self.upsert_statement(tablename,columns,key_cols)
+                sql, cols = statements[columns]
+                self.conn.executemany(sql,table_rows(table,cols))
+            self.record_file(tablename,file,checksum,table.num_rows,date)
+            total_rows += table.num_rows
+            batch_rows += table.num_rows
+            if batch_rows >= self.batch_rows:
+                self.conn.commit()
+                batch_rows = 0
+        self.conn.commit()
+        report_load(tablename,total_rows,time.perf_counter()-start)
+        return total_rows
+
+    @contextmanager
+    def rebuild(self,tablename):
+        # secondary indexes are dropped during the load and built once at the end
+        self.create_table("create_etl_ledger.sql")
+        indexes = self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL"
+            ,(tablename,)
+        ).fetchall()
+        for name, _ in indexes:
+            self.conn.execute(f"DROP INDEX {name}")
+        self.conn.execute(f"DELETE FROM {tablename}")
+        self.conn.execute(f"DELETE FROM {self.ledger_tablename} WHERE tablename = ?",(tablename,))
+        self.conn.commit()
+        try:
+            yield
+        finally:
+            start = time.perf_counter()
+            for _, sql in indexes:
+                self.conn.execute(sql)
+            self.conn.commit()
+            print(f"Rebuilt {len(indexes)} indexes in {time.perf_counter()-start:.2f}s")
+
+    def _daily_where(self,tickers,start,end):
+        where, params = [], []
+        if tickers is not None:
+            where.append(f"ticker IN ({','.join('?'*len(tickers))})")
+            params.extend(tickers)
+        if start is not None:
+            where.append("date >= ?")
+            params.append(epoch_day(start))
+        if end is not None:
+            where.append("date <= ?")
+            params.append(epoch_day(end))
+        return (" WHERE " + " AND ".join(where) if where else ""), params
+
+    def read_daily(self,tickers=None,start=None,end=None,columns=None):
+        columns = columns or DAILY_COLUMNS
+        select = ",".join("date(date*86400,'unixepoch') AS date" if col == "date" else col for col in columns)
+        where, params = self._daily_where(tickers,start,end)
+        return pd.read_sql_query(f"SELECT {select} FROM {self.daily_tablename}{where}",self.conn,params=params)
+
+    def iter_daily(self,tickers=None,start=None,end=None,columns=None,batch_rows=100000):
+        # dates stay epoch days on the way out of sqlite and become date32 without string parsing
+        columns = columns or DAILY_COLUMNS
+        where, params = self._daily_where(tickers,start,end)
+        cursor = self.conn.execute(f"SELECT {','.join(columns)} FROM {self.daily_tablename}{where}",params)
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                return
+            arrays = [
+                pa.array(values,type=pa.int32()).cast(pa.date32()) if col == "date" else pa.array(values)
+                for col, values in zip(columns,zip(*rows))
+            ]
+            yield pa.RecordBatch.from_arrays(arrays,names=columns)
+
+    def daily_bounds(self):
+        first, last = self.conn.execute(f"SELECT MIN(date), MAX(date) FROM {self.daily_tablename}").fetchone()
+        if first is None:
+            return None, None
+        return from_epoch_day(first).isoformat(), from_epoch_day(last).isoformat()
+
+    def read_table(self,name,columns=None,filters=None):
+        select = ",".join(columns) if columns else "*"
+        where, params = filter_clause(filters)
+        return pd.read_sql_query(f"SELECT {select} FROM {name}{where}",self.conn,params=params)
+
+    def iter_table(self,name,columns=None,filters=None,batch_rows=50000):
+        select = ",".join(columns) if columns else "*"
+        where, params = filter_clause(filters)
+        cursor = self.conn.execute(f"SELECT {select} FROM {name}{where}",params)
+        names = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                return
+            # column types are inferred per batch, callers cast to their target schema
+            yield pa.RecordBatch.from_arrays([pa.array(values) for values in zip(*rows)],names=names)
+
+    def write_table(self,name,df):
+        df.to_sql(name=name,con=self.conn,if_exists="replace",index=False)
+        self.conn.commit()
+
+    def table_key(self,tablename):
+        # primary key columns in key order
+        rows = [row for row in self.conn.execute(f"PRAGMA table_info({tablename})") if row[5] > 0]
+        return [row[1] for row in sorted(rows,key=lambda row: row[5])]
+
+    def upsert_table(self,name,df,key_cols,replace=False):
+        # create_{name}.sql defines the keyed layout, a table written without that key
+        # (e.g. by write_table) is dropped and recreated
+        if self.table_columns(name) and self.table_key(name) != list(key_cols):
+            print(f"Recreating {name} with primary key {key_cols}")
+            self.conn.execute(f"DROP TABLE {name}")
+        self.create_table(f"create_{name}.sql")
+        if replace:
+            self.conn.execute(f"DELETE FROM {name}")
+        table = pa.Table.from_pandas(df,preserve_index=False)
+        if table.num_rows > 0:
+            sql, cols = self.upsert_statement(name,table.column_names,key_cols)
+            self.conn.executemany(sql,table_rows(table,cols))
+        self.conn.commit()
+        return table.num_rows
+
+    def max_value(self,name,column,filters=None):
+        table_cols = self.table_columns(name)
+        if column not in table_cols or any(col not in table_cols for col, _, _ in filters or []):
+            return None
+        where, params = filter_clause(filters)
+        return self.conn.execute(f"SELECT MAX({column}) FROM {name}{where}",params).fetchone()[0]
+
+
+class ParquetStore(DailyStore):
+    def __init__(self,root,use_duckdb=False):
+        # root is a local folder or any uri pyarrow understands, e.g. gs://bucket/store
+        self.fs, self.root = pafs.FileSystem.from_uri(root if "://" in root else os.path.abspath(root))
+        self.use_duckdb = use_duckdb
+        self.ledger_path = f"{self.root}/_ledger.json"
+        self.partitioning = ds.partitioning(pa.schema([("date",pa.string())]),flavor="hive")
+
+    def _exists(self,path):
+        return self.fs.get_file_info(path).type != pafs.FileType.NotFound
+
+    def _read_ledger(self):
+        if not self._exists(self.ledger_path):
+            return {}
+        with self.fs.open_input_stream(self.ledger_path) as f:
+            return json.loads(f.read())
+
+    def _write_ledger(self,ledger):
+        self.fs.create_dir(self.root,recursive=True)
+        with self.fs.open_output_stream(self.ledger_path) as f:
+            f.write(json.dumps(ledger).encode())
+
+    def _table_path(self,name):
+        return f"{self.root}/{name}.parquet"
+
+    def loaded_files(self,tablename):
+        return {file: entry["checksum"] for file, entry in self._read_ledger().get(tablename,{}).items()}
+
+    def load(self,tablename,items,key_cols):
+        # daily bars go to one partition per date, other tables are upserted into a single file
+        ledger = self._read_ledger()
+        entries = ledger.setdefault(tablename,{})
+        total_rows = 0
+        start = time.perf_counter()
+        others = []
+        for file, checksum, date, table in items:
+            if tablename == self.daily_tablename:
+                self._write_partition(date,table)
+            elif table.num_rows > 0:
+                others.append(table)
+            entries[Path(file).name] = {"checksum":checksum,"date":date,"row_count":table.num_rows,"loaded_at":utc_now()}
+            total_rows += table.num_rows
+        if others:
+            self._upsert_table(tablename,others,key_cols)
+        self._write_ledger(ledger)
+        report_load(tablename,total_rows,time.perf_counter()-start)
+        return total_rows
+
+    def _write_partition(self,date,table):
+        # each day is rewritten as a whole, so reloading a file is idempotent
+        folder = f"{self.root}/{self.daily_tablename}/date={date}"
+        if table.num_rows == 0:
+            # an empty file would break schema inference of the dataset, the day just has no partition
+            if self._exists(folder):
+                self.fs.delete_dir(folder)
+            return
+        self.fs.create_dir(folder,recursive=True)
+        if "date" in table.column_names:
+            table = table.drop_columns(["date"])
+        pq.write_table(table,f"{folder}/part-0.parquet",filesystem=self.fs,compression="zstd")
+
+    def _upsert_table(self,name,tables,key_cols):
+        df = pd.concat([table.to_pandas() for table in tables],ignore_index=True)
+        path = self._table_path(name)
+        if self._exists(path):
+            df = pd.concat([pq.read_table(path,filesystem=self.fs).to_pandas(),df],ignore_index=True)
+        df = df.drop_duplicates(subset=key_cols,keep="last")
+        self.write_table(name,df)
+
+    @contextmanager
+    def rebuild(self,tablename):
+        if tablename == self.daily_tablename:
+            folder = f"{self.root}/{self.daily_tablename}"
+            if self._exists(folder):
+                self.fs.delete_dir(folder)
+        elif self._exists(self._table_path(tablename)):
+            self.fs.delete_file(self._table_path(tablename))
+        ledger = self._read_ledger()
+        ledger.pop(tablename,None)
+        self._write_ledger(ledger)
+        yield
+
+    def read_daily(self,tickers=None,start=None,end=None,columns=None):
+        columns = columns or DAILY_COLUMNS
+        folder = f"{self.root}/{self.daily_tablename}"
+        if not self._exists(folder):
+            return pd.DataFrame(columns=columns)
+        if self.use_duckdb:
+            return self._query_daily_duckdb(folder,tickers,start,end,columns).df()
+        dataset = ds.dataset(folder,filesystem=self.fs,format="parquet",partitioning=self.partitioning)
+        return dataset.to_table(columns=columns,filter=daily_condition(tickers,start,end)).to_pandas()
+
+    def iter_daily(self,tickers=None,start=None,end=None,columns=None,batch_rows=100000):
+        columns = columns or DAILY_COLUMNS
+        folder = f"{self.root}/{self.daily_tablename}"
+        if not self._exists(folder):
+            return
+        if self.use_duckdb:
+            batches = self._query_daily_duckdb(folder,tickers,start,end,columns).fetch_record_batch(batch_rows)
+        else:
+            dataset = ds.dataset(folder,filesystem=self.fs,format="parquet",partitioning=self.partitioning)
+            batches = dataset.to_batches(columns=columns,filter=daily_condition(tickers,start,end),batch_size=batch_rows)
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            if "date" in columns:
+                # the partition value is a "YYYY-MM-DD" string
+                i = columns.index("date")
+                batch = batch.set_column(i,"date",pc.cast(batch.column(i),pa.date32()))
+            yield batch
+
+    def daily_bounds(self):
+        # partition names are enough, no file is opened
+        folder = f"{self.root}/{self.daily_tablename}"
+        if not self._exists(folder):
+            return None, None
+        dates = sorted(
+            info.base_name[len("date="):] for info in self.fs.get_file_info(pafs.FileSelector(folder))
+            if info.type == pafs.FileType.Directory and info.base_name.startswith("date=")
+        )
+        if not dates:
+            return None, None
+        return dates[0], dates[-1]
+
+    def _query_daily_duckdb(self,folder,tickers,start,end,columns):
+        # duckdb scans the arrow dataset, so it reads through the store's filesystem (local or gs://
+        # with the usual google credentials) and pushes the projection and filters into the scan
+        import duckdb
+        con = duckdb.connect()
+        con.register("daily",ds.dataset(folder,filesystem=self.fs,format="parquet",partitioning=self.partitioning))
+        where, params = [], []
+        if tickers is not None:
+            where.append(f"ticker IN ({','.join('?'*len(tickers))})")
+            params.extend(tickers)
+        if start is not None:
+            where.append("date >= ?")
+            params.append(str(start))
+        if end is not None:
+            where.append("date <= ?")
+            params.append(str(end))
+        sql = f"SELECT {','.join(columns)} FROM daily"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return con.execute(sql,params)
+
+    def _table_folder(self,name):
+        return f"{self.root}/{name}"
+
+    def _table_dataset(self,name):
+        # tables written by upsert_table are partitioned by date like daily
+        return ds.dataset(self._table_folder(name),filesystem=self.fs,format="parquet",partitioning=self.partitioning)
+
+    def read_table(self,name,columns=None,filters=None):
+        condition = pq.filters_to_expression(filters) if filters else None
+        if not self._exists(self._table_folder(name)):
+            return pq.read_table(self._table_path(name),columns=columns,filters=condition,filesystem=self.fs).to_pandas()
+        df = self._table_dataset(name).to_table(columns=columns,filter=condition).to_pandas()
+        if columns is None:
+            # the partition column comes last, put it back in front
+            df = df[["date"]+[col for col in df.columns if col != "date"]]
+        return df
+
+    def iter_table(self,name,columns=None,filters=None,batch_rows=50000):
+        condition = pq.filters_to_expression(filters) if filters else None
+        if self._exists(self._table_folder(name)):
+            dataset = self._table_dataset(name)
+        else:
+            dataset = ds.dataset(self._table_path(name),filesystem=self.fs,format="parquet")
+        yield from dataset.to_batches(columns=columns,filter=condition,batch_size=batch_rows)
+
+    def write_table(self,name,df):
+        self.fs.create_dir(self.root,recursive=True)
+        table = pa.Table.from_pandas(df,preserve_index=False)
+        pq.write_table(table,self._table_path(name),filesystem=self.fs,compression="zstd")
+
+    def upsert_table(self,name,df,key_cols,replace=False):
+        # only the date partitions present in df are rewritten, so a publish costs the days it touches
+        folder = self._table_folder(name)
+        if replace and self._exists(folder):
+            self.fs.delete_dir(folder)
+        if self._exists(self._table_path(name)):
+            # an unpartitioned copy from write_table is superseded
+            self.fs.delete_file(self._table_path(name))
+        part_keys = [col for col in key_cols if col != "date"]
+        for date, part in df.groupby("date",sort=True):
+            partition = f"{folder}/date={date}"
+            path = f"{partition}/part-0.parquet"
+            part = part.drop(columns=["date"])
+            if self._exists(path):
+                part = pd.concat([pq.read_table(path,filesystem=self.fs).to_pandas(),part],ignore_index=True)
+            part = stable_types(part.drop_duplicates(subset=part_keys,keep="last"))
+            self.fs.create_dir(partition,recursive=True)
+            pq.write_table(pa.Table.from_pandas(part,preserve_index=False),path,filesystem=self.fs,compression="zstd")
+        return len(df)
+
+    def max_value(self,name,column,filters=None):
+        if not self._exists(self._table_folder(name)):
+            return None
+        dataset = self._table_dataset(name)
+        if column not in dataset.schema.names or any(col not in dataset.schema.names for col, _, _ in filters or []):
+            return None
+        condition = pq.filters_to_expression(filters) if filters else None
+        values = dataset.to_table(columns=[column],filter=condition).column(column)
+        return pc.max(values).as_py()
+
+
+def daily_condition(tickers,start,end):
+    # partition pruning on date, row group filtering on ticker
+    condition = None
+    for expression in (
+        ds.field("ticker").isin(tickers) if tickers is not None else None,
+        ds.field("date") >= str(start) if start is not None else None,
+        ds.field("date") <= str(end) if end is not None else None,
+    ):
+        if expression is not None:
+            condition = expression if condition is None else condition & expression
+    return condition
+
+def filter_clause(filters):
+    # [(column, op, value), ...] -> (" WHERE ...", params)
+    if not filters:
+        return "", []
+    ops = {"=":"=","==":"=","!=":"!=","<":"<","<=":"<=",">":">",">=":">="}
+    where = " AND ".join(f"{col} {ops[op]} ?" for col, op, _ in filters)
+    return f" WHERE {where}", [value for _, _, value in filters]
+
+def stable_types(df):
+    # numbers (and all-null columns) become float64 so every partition of a table has the same schema
+    # whether or not its rows had gaps
+    columns = {}
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]) or df[col].isna().all():
+            columns[col] = "float64"
+    return df.astype(columns)
+
+def table_rows(table,cols):
+    # column-wise numpy tolist() gives python scalars, zip turns them into row tuples for executemany
+    return zip(*[table.column(col).to_numpy(zero_copy_only=False).tolist() for col in cols])
+
+def report_load(tablename,total_rows,elapsed):
+    print(f"Loaded {total_rows} rows into {tablename} in {elapsed:.2f}s ({total_rows/max(elapsed,1e-9):.0f} rows/sec)")
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
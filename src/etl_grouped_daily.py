@@ -1,19 +1,24 @@
 """
 Script to insert/combine into a database table
-The database is simulated by a sqllite file
+The database is simulated by a sqllite file, or date-partitioned parquet (see daily_store)
 """
 import os
-import pandas as pd
-import sqlite3
+import argparse
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
 from dotenv import load_dotenv
 from pathlib import Path
+from trading_calendar import is_trading_day, epoch_day
+from daily_files import is_grouped_daily_file, read_grouped_daily
+from daily_store import SQLiteStore, get_store
 
 class ETL:
-    def __init__(self, data_folder,script_folder):
+    def __init__(self, data_folder,script_folder,store=None,workers=1,max_pending=None):
         self.data_folder = data_folder
         self.script_folder = script_folder
         # json folders
-        self.ticker_json_folder = os.path.join(data_folder,"ticker_json")
         self.grouped_daily_json_folder = os.path.join(data_folder,"grouped_daily_json")
 
         # sql scripts folder
@@ -21,91 +26,130 @@ class ETL:
 
         # make dirs if not exists
         os.makedirs(self.data_folder,exist_ok=True)
-        os.makedirs(self.ticker_json_folder,exist_ok=True)
         os.makedirs(self.grouped_daily_json_folder,exist_ok=True)
 
-        # sqlite tablenames
-        self.ticker_tablename = "tickers"
+        # tablenames
         self.daily_tablename = "daily"
 
-        # database
-        self.database = "stock.db"
-        self.conn = None
-        
-    def connectOrCreateDatabase(self):
-        # Assuming that the db file is stored on the VM
-        db_file = os.path.join(self.data_folder,self.database)
-        self.conn = sqlite3.connect(db_file)
-    
+        # stock.db unless another backend is passed in
+        self.store = store if store is not None else SQLiteStore(os.path.join(data_folder,"stock.db"),self.sql_scripts)
+        # decoding processes, the writer stays in this process and owns the store
+        self.workers = workers
+        # decoded files allowed to wait for the writer, caps memory
+        self.max_pending = max_pending or 2*workers
+
     def createTable(self,sql_script):
-        self.connectOrCreateDatabase()
-        
-        sql_path = os.path.join(self.sql_scripts,sql_script)
-        with open(sql_path,"r") as f:
-            self.conn.cursor().executescript(f.read())
-        
-        self.conn.commit()
-        self.conn.close()
-
-    def updateTickerTable(self):
-        self.connectOrCreateDatabase()
-        json_files = os.listdir(self.ticker_json_folder)
-        json_files = [file for file in json_files if "ticker" in file]
-        json_files = [os.path.join(self.ticker_json_folder,file) for file in json_files]
-
-        for file in json_files:
-            df = pd.read_json(file)
-            if len(df) == 0:
-                continue
-            try:
-                df.to_sql(name="tickers",con=self.conn, if_exists="append",index=False)
-            except:
-                print("Upsert debug: key exists")
-        
-        self.conn.commit()
-        self.conn.close()
-
-    def updateDailyTable(self):
-        self.connectOrCreateDatabase()
+        self.store.create_table(sql_script)
+
+    def migrateDailyTable(self):
+        return self.store.migrate()
+
+    def pendingFiles(self,tablename,files,incremental):
+        # files that are new or changed since they were last loaded, with their checksums
+        loaded = self.store.loaded_files(tablename) if incremental else {}
+        if self.workers > 1:
+            with ProcessPoolExecutor(self.workers) as executor:
+                checksums = list(executor.map(file_checksum,files,chunksize=16))
+        else:
+            checksums = [file_checksum(file) for file in files]
+        pending = [
+            (file,checksum) for file, checksum in zip(files,checksums)
+            if loaded.get(Path(file).name) != checksum
+        ]
+        print(f"{len(pending)} of {len(files)} files to load into {tablename}")
+        return pending
+
+    def decoded(self,decode_fn,pending):
+        # decode files in a process pool, yielding in file order with at most max_pending in flight
+        if self.workers <= 1:
+            for file, checksum in pending:
+                yield decode_fn(file,checksum)
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = deque()
+            for file, checksum in pending:
+                futures.append(executor.submit(decode_fn,file,checksum))
+                if len(futures) >= self.max_pending:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    def dailyFiles(self):
         json_files = os.listdir(self.grouped_daily_json_folder)
-        json_files = [file for file in json_files if "full" not in file]
-        json_files = [os.path.join(self.grouped_daily_json_folder,file) for file in json_files]
-
-        rename_dict = {
-            "T":"ticker"
-            , "o":"open_price"
-            , "c":"close_price"
-            , "h":"highest_price"
-            , "l":"lowest_price"
-            , "n":"number_of_transactions"
-            , "v":"trading_volume"
-            , "vw":"volume_weighted_average_price"
-            , "otc":"otc_sticker"
-            , "t":"window_start_timestamp"
-        }
-
-        for file in json_files:
-            df = pd.read_json(file)
-            if len(df) == 0:
-                continue
-            df.rename(columns=rename_dict,inplace=True)
-            df["date"] = Path(file).stem
-            df.to_sql(name="daily",con=self.conn, if_exists="append",index=False)
+        json_files = [file for file in json_files if is_grouped_daily_file(file)]
+        # files for non-trading days only ever hold an empty result
+        json_files = [file for file in json_files if is_trading_day(Path(file).stem)]
+        return [os.path.join(self.grouped_daily_json_folder,file) for file in sorted(json_files)]
 
+    def updateDailyTable(self,incremental=True):
+        # incremental only reads files that are not in the ledger or whose checksum changed
+        pending = self.pendingFiles(self.daily_tablename,self.dailyFiles(),incremental)
+        items = self.decoded(decode_daily_file,pending)
+        self.store.load(self.daily_tablename,items,["ticker","date"])
 
-if __name__ == "__main__":
+    def rebuildDailyTable(self):
+        # full reload of every local file into an emptied table
+        with self.store.rebuild(self.daily_tablename):
+            self.updateDailyTable(incremental=False)
+
+
+RENAME_DICT = {
+    "T":"ticker"
+    , "o":"open_price"
+    , "c":"close_price"
+    , "h":"highest_price"
+    , "l":"lowest_price"
+    , "n":"number_of_transactions"
+    , "v":"trading_volume"
+    , "vw":"volume_weighted_average_price"
+    , "otc":"otc_sticker"
+    , "t":"window_start_timestamp"
+}
+
+# decoders run in worker processes, so they live at module level
+def decode_daily_file(file,checksum):
+    # polygon short names -> daily table columns, plus the epoch day taken from the file name
+    date = Path(file).stem
+    table = read_grouped_daily(file,as_arrow=True)
+    table = table.rename_columns([RENAME_DICT.get(col,col) for col in table.column_names])
+    table = table.append_column("date",pa.array([epoch_day(date)]*table.num_rows,pa.int32()))
+    return file, checksum, date, table
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path,"rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20),b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main(store=None,migrate_only=False):
+    # store can be shared with other stages (see pipeline.py), it is only closed when opened here
     print("Start etl grouped daily")
     script_folder = Path(__file__).resolve().parent # can also use os.path.dirname(__file__)
     env_path = os.path.join(script_folder.parent,".env")
     load_dotenv(env_path)
     data_folder = os.environ.get("DATA_FOLDER")
-    etl = ETL(data_folder=data_folder,script_folder=script_folder)
-    # etl.createTable("create_tickers.sql")
-    # etl.updateTickerTable()
+    workers = int(os.environ.get("ETL_WORKERS",os.cpu_count() or 1))
+    etl = ETL(data_folder=data_folder,script_folder=script_folder,store=store or get_store(data_folder),workers=workers)
+    # no-op once the table has been migrated
+    etl.migrateDailyTable()
+    if migrate_only:
+        return
+    # the tickers table is written by get_ticker_reference.py
     etl.createTable("create_daily.sql")
-    etl.updateDailyTable()
+    # "rebuild" reloads every local file into an emptied daily table
+    if os.environ.get("ETL_MODE","incremental") == "rebuild":
+        etl.rebuildDailyTable()
+    else:
+        etl.updateDailyTable()
+    if store is None:
+        etl.store.close()
     print("End etl grouped daily")
 
-    
-
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--migrate",action="store_true",help="only convert an existing daily table to the typed schema")
+    args = parser.parse_args()
+    main(migrate_only=args.migrate)
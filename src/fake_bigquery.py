@@ -0,0 +1,111 @@
+"""
+In-memory stand-in for google.cloud.bigquery.Client, enough of it for bigquery.py
+Tables are arrow tables, load jobs read the staged Parquet file and the two queries
+bigquery.py issues (MAX of a column, MERGE on key columns) are evaluated locally.
+Only the exception types come from google-api-core
+"""
+import re
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import BadRequest, NotFound
+
+MAX_QUERY = re.compile(r"SELECT MAX\((\w+)\) AS (\w+) FROM `([^`]+)`",re.IGNORECASE)
+MERGE_QUERY = re.compile(r"MERGE `([^`]+)` T USING `([^`]+)` S ON (.+?) WHEN MATCHED",re.IGNORECASE)
+
+
+class FakeTable:
+    def __init__(self,table_id,schema,time_partitioning=None):
+        self.table_id = table_id
+        self.schema = list(schema)
+        self.time_partitioning = time_partitioning
+        self.data = pa.Table.from_pylist([],schema=pa.schema([(field.name,pa.null()) for field in self.schema]))
+
+    @property
+    def num_rows(self):
+        return self.data.num_rows
+
+
+class FakeJob:
+    def __init__(self,rows=None,output_rows=None):
+        self.rows = rows or []
+        self.output_rows = output_rows
+
+    def result(self):
+        return self.rows
+
+
+class FakeClient:
+    def __init__(self,project="fake-project"):
+        self.project = project
+        self.datasets = set()
+        self.tables = {}
+        # every load job and query, for inspection
+        self.load_jobs = []
+        self.queries = []
+
+    def get_dataset(self,dataset_id):
+        if str(dataset_id) not in self.datasets:
+            raise NotFound(f"Dataset {dataset_id} not found")
+        return dataset_id
+
+    def create_dataset(self,dataset,timeout=None):
+        self.datasets.add(f"{dataset.project}.{dataset.dataset_id}")
+        return dataset
+
+    def get_table(self,table_id):
+        if table_id not in self.tables:
+            raise NotFound(f"Table {table_id} not found")
+        return self.tables[table_id]
+
+    def delete_table(self,table_id,not_found_ok=False):
+        if table_id not in self.tables and not not_found_ok:
+            raise NotFound(f"Table {table_id} not found")
+        self.tables.pop(table_id,None)
+
+    def schema_from_json(self,path):
+        # the api representation of each field, LoadJobConfig turns them into SchemaFields
+        with open(path,"r") as f:
+            return [{"name":field["name"],"type":field["type"],"mode":field.get("mode","NULLABLE")} for field in json.load(f)]
+
+    def load_table_from_file(self,file_obj,table_id,job_config=None):
+        data = pq.read_table(file_obj)
+        table = self.tables.get(table_id)
+        partitioning = job_config.time_partitioning if job_config is not None else None
+        truncate = job_config is not None and job_config.write_disposition == "WRITE_TRUNCATE"
+        # like bigquery, an existing table keeps its partitioning spec
+        if table is not None and partitioning_field(table.time_partitioning) != partitioning_field(partitioning):
+            raise BadRequest(f"Incompatible table partitioning specification for {table_id}")
+        if table is None or truncate:
+            schema = job_config.schema if job_config is not None and job_config.schema else table.schema
+            table = FakeTable(table_id,schema,partitioning)
+            table.data = data
+            self.tables[table_id] = table
+        else:
+            table.data = pa.concat_tables([table.data,data.cast(table.data.schema)])
+        self.load_jobs.append({"table_id":table_id,"rows":data.num_rows,"job_config":job_config})
+        return FakeJob(output_rows=data.num_rows)
+
+    def query(self,query):
+        self.queries.append(query)
+        match = MAX_QUERY.search(query)
+        if match:
+            column, alias, table_id = match.groups()
+            values = self.get_table(table_id).data.column(column).to_pylist()
+            values = [value for value in values if value is not None]
+            return FakeJob(rows=[{alias:max(values) if values else None}])
+        match = MERGE_QUERY.search(query)
+        if match:
+            table_id, source_id, on = match.groups()
+            keys = re.findall(r"T\.(\w+) = S\.\1",on)
+            target, source = self.get_table(table_id), self.get_table(source_id)
+            merged = pd.concat([target.data.to_pandas(),source.data.to_pandas()],ignore_index=True)
+            merged = merged.drop_duplicates(subset=keys,keep="last")
+            target.data = pa.Table.from_pandas(merged,schema=target.data.schema,preserve_index=False)
+            return FakeJob()
+        raise NotImplementedError(f"FakeClient can't run: {query}")
+
+
+def partitioning_field(time_partitioning):
+    return getattr(time_partitioning,"field",None)
@@ -0,0 +1,89 @@
+"""
+Concurrent fetch engine shared by the polygon request scripts
+A token bucket paces every request sent through the shared session,
+so any number of workers together stay under the plan's rate limit
+"""
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self,requests_per_minute,burst=1):
+        self.rate = requests_per_minute/60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # block until a token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,self.tokens + (now-self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1-self.tokens)/self.rate
+            time.sleep(wait)
+
+
+class RateLimitedSession(requests.Session):
+    def __init__(self,limiter,max_retries=5,backoff=2.0,pool_size=10):
+        super().__init__()
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+        self.mount("https://",adapter)
+        self.mount("http://",adapter)
+
+    def request(self,method,url,**kwargs):
+        kwargs.setdefault("timeout",60)
+        for attempt in range(self.max_retries+1):
+            self.limiter.acquire()
+            try:
+                response = super().request(method,url,**kwargs)
+            except (requests.ConnectionError,requests.Timeout) as err:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Retrying after {type(err).__name__} (attempt {attempt+1})")
+                time.sleep(self.backoff*2**attempt)
+                continue
+            if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                return response
+            # honour Retry-After when the server sends one
+            retry_after = response.headers.get("Retry-After")
+            try:
+                wait = float(retry_after)
+            except (TypeError,ValueError):
+                wait = self.backoff*2**attempt
+            print(f"Retrying after HTTP {response.status_code} (attempt {attempt+1}), sleeping {wait:.1f}s")
+            response.close()
+            time.sleep(wait)
+
+
+def make_session(requests_per_minute=5,max_workers=4,burst=1,max_retries=5):
+    limiter = TokenBucket(requests_per_minute,burst=burst)
+    return RateLimitedSession(limiter,max_retries=max_retries,pool_size=max_workers)
+
+
+def run_jobs(fn,items,max_workers=4):
+    # run fn over items on a bounded worker pool, returns {item: result or exception}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fn,item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as err:
+                print(f"{item} failed: {err}")
+                results[item] = err
+    return results
@@ -1,182 +1,350 @@
 """
 This script creates/updates small daily together with model inference step
 """
-import torch
 import json
 import os
-import sqlite3
+import bisect
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 from dotenv import load_dotenv
-from datetime import datetime as dt, timedelta
-
-from forecasting.data_prep import DataPrep
-from forecasting.models import LSTMModel
-
-
-def load_db_data(conn,sql_path):
-    with open(sql_path,"r") as sql:
-        df = pd.read_sql_query(sql.read(),conn)
-    return df
+from datetime import datetime as dt
+
+from forecasting.data_prep import DataPrep, update_tickers_config
+from forecasting.models import build_model, configure_threads
+from forecasting.export import ARTIFACT_NAME, export_model, load_exported
+from trading_calendar import next_trading_days, previous_trading_days, trading_days, epoch_day, to_date
+from daily_store import get_store, utc_now
+
+TICKERS = ["META","AMZN","NFLX","GOOG","AAPL"]
+SMALL_DAILY_KEYS = ["date","ticker","run_id"]
+# run_id of actual closes and of one-step predictions, a forecast is stored under its run's as-of date
+ACTUAL_RUN = "actual"
+ONE_STEP_RUN = "one_step"
+# written after every other file of a training, readers such as forecasting/server.py reload on it
+MODEL_MARKER = "model_version.json"
+
+
+def load_db_data(store,tickers=TICKERS,start=None,end=None,chunk_rows=100000):
+    # date x ticker float32 close frame for DataPrep, streamed in chunks of (date, ticker, close_price)
+    # into an array preallocated from the trading calendar, so memory is the matrix plus one chunk
+    first, last = store.daily_bounds()
+    tickers = sorted(tickers)
+    start = max(to_date(start),to_date(first)) if start is not None and first is not None else first
+    end = min(to_date(end),to_date(last)) if end is not None and last is not None else last
+    days = trading_days(start,end) if first is not None else []
+    if not days:
+        return pd.DataFrame(np.empty((0,len(tickers)),dtype=np.float32),index=pd.Index([],name="date"),columns=pd.Index(tickers,name="ticker"))
+
+    values = np.full((len(days),len(tickers)),np.nan,dtype=np.float32)
+    offset = epoch_day(days[0])
+    day_rows = np.full(epoch_day(days[-1])-offset+1,-1)
+    day_rows[np.array([epoch_day(day) for day in days])-offset] = np.arange(len(days))
+    skipped = 0
+    for batch in store.iter_daily(tickers=tickers,start=days[0],end=days[-1],columns=["date","ticker","close_price"],batch_rows=chunk_rows):
+        rows = day_rows[batch.column(0).cast(pa.int32()).to_numpy()-offset]
+        cols = pd.Categorical(batch.column(1).to_numpy(zero_copy_only=False),categories=tickers).codes
+        keep = (rows >= 0) & (cols >= 0)
+        values[rows[keep],cols[keep]] = batch.column(2).to_numpy(zero_copy_only=False)[keep]
+        skipped += int((~keep).sum())
+    if skipped:
+        print(f"Skipped {skipped} rows on dates outside the trading calendar")
+
+    # days without any bar (not loaded yet) and tickers without any bar are dropped
+    observed_days = ~np.isnan(values).all(axis=1)
+    observed_tickers = ~np.isnan(values).all(axis=0)
+    if not observed_tickers.all():
+        print(f"No data for {[ticker for ticker, seen in zip(tickers,observed_tickers) if not seen]}")
+    return pd.DataFrame(
+        values[observed_days][:,observed_tickers],
+        index=pd.Index([day.isoformat() for day, seen in zip(days,observed_days) if seen],name="date"),
+        columns=pd.Index([ticker for ticker, seen in zip(tickers,observed_tickers) if seen],name="ticker"),
+    )
+
+def universe(train_config):
+    # tickers and [start, end] to read, lookback_days counts trading days back from today
+    lookback = train_config.get("lookback_days")
+    start = previous_trading_days(dt.today().date(),lookback)[0].isoformat() if lookback else None
+    return train_config.get("tickers",TICKERS), start
 
 def trainer(df,model_config_path,model_path,models_folder,train_config_path):
+    # "incremental" (default) fine-tunes the saved model on the days after the watermark,
+    # "full" retrains from scratch on the whole history
     with open(train_config_path,"r") as f:
         train_config = json.load(f)
     if dt.today().weekday() != train_config["train_start"]:
         return
     window_size = train_config["window_size"]
-    epochs = train_config["epochs"]
-    with open(train_config_path,"w") as f:
-        json.dump(train_config,f)
-    
-    model = load_model(model_config_path)
-    train_dataset = DataPrep(df,window_size)
-    train_dataset.save_tickers(models_folder)
-    train_dataloader = train_dataset.get_loader()
+    configure_threads(train_config.get("num_threads"),train_config.get("interop_threads"))
+
+    tickers_config_path = os.path.join(models_folder,"tickers_config.json")
+    watermark = train_config.get("watermark")
+    train_mode = "full"
+    tickers_config = None
+    if train_config.get("train_mode","incremental") == "incremental" and watermark is not None \
+            and os.path.exists(model_path) and os.path.exists(tickers_config_path):
+        with open(tickers_config_path) as f:
+            tickers_config = json.load(f)
+        # warm start needs running counts and the same ticker universe as the saved model
+        if any("count" not in stats for stats in tickers_config.values()) \
+                or set(tickers_config) != set(df.columns):
+            print("Saved model can't be warm-started, retraining from scratch")
+            tickers_config = None
+
+    if tickers_config is not None:
+        dates = df.index
+        first_new = dates.searchsorted(watermark,side="right")
+        if first_new == len(dates):
+            print(f"No data after watermark {watermark}, skipping training")
+            return
+        tickers_config = update_tickers_config(tickers_config,df,since=watermark)
+        # window_size days of context so the first new day is already a target
+        train_df = df.iloc[max(first_new-window_size,0):]
+        train_dataset = DataPrep(train_df,window_size,tickers_config=tickers_config,with_targets=True)
+        model = load_model(model_config_path,model_path)
+        epochs = train_config.get("incremental_epochs",50)
+        lr = train_config.get("incremental_lr",0.001)
+        train_mode = "incremental"
+        print(f"Incremental training on {len(dates)-first_new} days after {watermark}")
+    else:
+        train_dataset = DataPrep(df,window_size)
+        model = load_model(model_config_path,tickers=list(train_dataset.tickers_config))
+        epochs = train_config["epochs"]
+        lr = train_config.get("lr",0.01)
+        print("Full training")
+    if len(train_dataset) == 0:
+        print("Not enough data to train")
+        return
+
+    series_ids = model.ticker_ids(train_dataset.tickers_config) if model.series_input else None
+    train_dataloader, val_dataloader = train_dataset.get_split_loaders(
+        train_config.get("val_fraction",0.1),train_config.get("batch_size",8),series_ids=series_ids)
     print("Training starts")
-    model.train_fn(train_dataloader,epochs)
+    history = model.train_fn(
+        train_dataloader,epochs,val_loader=val_dataloader,
+        lr=lr,
+        patience=train_config.get("patience",100),
+        scheduler_patience=train_config.get("scheduler_patience",25),
+        checkpoint_path=os.path.join(models_folder,"checkpoint.pt"),
+        checkpoint_every=train_config.get("checkpoint_every",50),
+        # a checkpoint of an interrupted run with other settings or data is discarded, not resumed
+        run_info={"train_mode":train_mode,"epochs":epochs,"lr":lr,"watermark":watermark,
+                  "tickers":list(train_dataset.tickers_config)},
+    )
+    print(f"Trained {history['epochs']} epochs, best loss: {history['best_loss']}")
+    # stats and watermark are only written once the model is, a rerun after a crash starts from the same state
     model.save_model(models_folder)
+    train_dataset.save_tickers(models_folder)
+    watermark = str(df.index[-1])
+    if train_config.get("export",True):
+        export_inference_model(model,train_dataset,models_folder,watermark,train_config)
+    train_config["watermark"] = watermark
+    with open(train_config_path,"w") as f:
+        json.dump(train_config,f)
+    with open(os.path.join(models_folder,MODEL_MARKER),"w") as f:
+        json.dump({"watermark":watermark,"trained_at":utc_now()},f)
     print("Training ends")
-    
 
 
-
-
-def load_inference_data(df,tickers_config_path,train_config_path):
+def export_inference_model(model,dataset,models_folder,watermark,train_config):
+    # the eager model stays the fallback when the export fails its parity check
+    tickers = list(dataset.tickers_config.keys())
+    mean, std = dataset.normalization()
+    metadata = {
+        "tickers_config":dataset.tickers_config,
+        "window_size":dataset.window_size,
+        "watermark":watermark,
+    }
+    try:
+        metadata = export_model(
+            model,os.path.join(models_folder,ARTIFACT_NAME),metadata,
+            quantize=train_config.get("quantize",False),
+            example=(dataset.windows[-64:],mean,std,tickers),
+        )
+        print(f"Exported {ARTIFACT_NAME}, parity error: {metadata['parity_error']:.2e}")
+    except RuntimeError as err:
+        print(f"Export failed: {err}")
+
+def load_inference_data(df,tickers_config_path,train_config_path,tickers_config=None):
     with open(train_config_path,"r") as f:
         train_config = json.load(f)
     window_size = train_config["window_size"]
     
+    if tickers_config is not None:
+        return DataPrep(df,window_size=window_size,tickers_config=tickers_config)
     inference_dataset = DataPrep(df,window_size=window_size,tickers_config_path=tickers_config_path)
     return inference_dataset
 
-def load_model(model_config_path,model_path=None):
+def load_forecaster(models_folder,model_config_path,model_path,train_config_path):
+    # returns (model, tickers_config): the exported artifact when it is from the latest training,
+    # otherwise the eager model and tickers_config.json
+    with open(train_config_path,"r") as f:
+        watermark = json.load(f).get("watermark")
+    artifact_path = os.path.join(models_folder,ARTIFACT_NAME)
+    if os.path.exists(artifact_path):
+        try:
+            model = load_exported(artifact_path)
+        except (ValueError,RuntimeError) as err:
+            # unsupported format version or a corrupt file
+            print(f"Could not load {ARTIFACT_NAME} ({err}), using the eager model")
+        else:
+            if model.metadata.get("watermark") == watermark:
+                return model, model.metadata["tickers_config"]
+            print(f"{ARTIFACT_NAME} is older than the last training, using the eager model")
+    return load_model(model_config_path,model_path), None
+
+def load_model(model_config_path,model_path=None,tickers=None):
+    # tickers seeds the vocabulary of a global model trained from scratch
     with open(model_config_path) as f:
         model_config = json.load(f)
-    model = LSTMModel(**model_config)
+    if tickers is not None and model_config.get("model_type") == "global_lstm":
+        model_config["tickers"] = tickers
+    model = build_model(model_config)
     if model_path:
         model.load_model(model_path)
     return model
 
-def predict_historical_data(model, dataset):
+def to_long_frame(values,dates,tickers,suffix="_pred"):
+    # (dates x tickers) matrix -> long (date, ticker, close_price) rows, date-major
+    values = np.asarray(values)
+    return pd.DataFrame({
+        "date":np.repeat(np.asarray(dates,dtype=object),len(tickers)),
+        "ticker":np.tile(np.asarray([ticker+suffix for ticker in tickers],dtype=object),len(dates)),
+        "close_price":values.reshape(-1),
+    })
+
+def predict_historical_data(model, dataset, since=None):
     # historical index
     historical_index = dataset.data_index[len(dataset.data_index)-len(dataset.windows):]
+    windows = dataset.windows
+    tickers = list(dataset.tickers_config.keys())
+    if since is not None:
+        # only the dates after since
+        first = bisect.bisect_right(historical_index,since)
+        historical_index, windows = historical_index[first:], windows[first:]
+    if not historical_index:
+        return to_long_frame(np.empty((0,len(tickers))),[],tickers)
 
-    # get full loader
-    loader = dataset.get_loader(batch_size=len(dataset.windows),shuffle=False)
-    pred = model.predict(next(iter(loader)))
+    # one-step forecast from every window, works for both model families
+    mean, std = dataset.normalization()
+    pred = model.forecast(windows,1,mean,std,tickers)[:,0]
 
     # convert to row format
+    return to_long_frame(pred.numpy(),historical_index,tickers)
+
+def forecast_next_n(model,dataset,n=5):
+    # next n NYSE trading days after the last observed date
+    inference_index = [day.isoformat() for day in next_trading_days(dataset.data_index[-1],n)]
+
     tickers = list(dataset.tickers_config.keys())
-    pred = pd.DataFrame(pred.numpy(),columns=tickers,index=historical_index)
-    cols = ["date","ticker","close_price"]
-    pred_historical = pd.DataFrame(columns=cols)
-    for ix, row in pred.iterrows():
-        for ticker in tickers:
-            tmp = pd.DataFrame([[ix,ticker+"_pred",row[ticker]]],columns=cols)
-            pred_historical = pd.concat([pred_historical,tmp],ignore_index=True,axis=0)
+    mean, std = dataset.normalization()
+    pred = model.forecast(dataset.origin_windows(),n,mean,std,tickers)[0]
 
-    return pred_historical
+    return to_long_frame(pred.numpy(),inference_index,tickers)
 
-def forecast_next_n(model,dataset,n=5):
-    # generate next n business day (assume Monday through Friday)
-    def convert_to_datetime(s):
-        format = '%Y-%m-%d'
-        datetime_str = dt.strptime(s, format)
-        return datetime_str
-    def convert_from_datetime(dt_str):
-        format = '%Y-%m-%d'
-        s = dt.strftime(dt_str, format)
-        return s
-    day = convert_to_datetime(dataset.data_index[-1])
-    inference_index = []
-    for _ in range(n):
-        business_check = False
-        while not business_check:
-            day = day + timedelta(days=1)
-            if day.weekday() <= 4:
-                inference_index.append(convert_from_datetime(day))
-                business_check = True
-
-    cols = ["date","ticker","close_price"]
-    forecast = pd.DataFrame(columns=cols)
-
-    window_size = dataset[0].shape[0] # (T,C)
-    forecast_window = dataset.data[-window_size:]
+
+def rolling_forecast(model,dataset,n=5,origins=None):
+    # forecasts from many origins in one batched call, origins are row positions in dataset.data
+    # returns long rows with the origin date and the step ahead (1..n)
+    if origins is None:
+        origins = range(dataset.window_size-1,len(dataset.data_index))
+    origins = list(origins)
     tickers = list(dataset.tickers_config.keys())
-    for i, date in enumerate(inference_index):
-        if i != 0:
-            # update forecast_window
-            forecast_window = torch.cat([forecast_window,pred])[1:,:]
-        
-        # print(forecast_window.shape)
-        # normalize forecast_window
-        norm = forecast_window.detach().clone()
-        for j, ticker in enumerate(tickers):
-            norm[:,j] = (forecast_window[:,j] - dataset.tickers_config[ticker]["mean"])/dataset.tickers_config[ticker]["std"]
-        pred = model.predict(norm.unsqueeze(0))
-
-        pred_frame = pd.DataFrame(pred.numpy(),columns=tickers) # tmp only has one like
-        for j, ticker in enumerate(tickers):
-            tmp = pd.DataFrame([[date,ticker+"_pred",pred_frame.iloc[0,j]]],columns=cols)
-            forecast = pd.concat([forecast,tmp],ignore_index=True,axis=0)
-    
-    return forecast
+    mean, std = dataset.normalization()
+    pred = model.forecast(dataset.origin_windows(origins),n,mean,std,tickers) # (B,n,C)
+
+    origin_dates = [dataset.data_index[i] for i in origins]
+    out = to_long_frame(pred.reshape(-1,len(tickers)).numpy(),np.repeat(np.asarray(origin_dates,dtype=object),n),tickers)
+    out.insert(0,"horizon",np.tile(np.repeat(np.arange(1,n+1),len(tickers)),len(origins)))
+    out.rename(columns={"date":"origin_date"},inplace=True)
+    return out
 
 
-def write_to_db(conn,dataset,df,forecast,pred_historical = None):
-    # write to db
+def write_to_db(store,dataset,df,forecast,pred_historical = None):
+    # full refresh: replaces small_daily, forecasts of earlier runs are dropped
+    run_id = dataset.data_index[-1]
+    frames = [df.assign(run_id=ACTUAL_RUN)]
     if pred_historical is None:
+        # anchor the forecast line at the last actual close
         last = dataset.data_index[-1]
-        cols = ["date","ticker","close_price"]
         tickers = list(dataset.tickers_config.keys())
-        for ticker in tickers:
-            row_id = df.index[(df["date"]==last) & (df["ticker"]==ticker)].tolist()[0]
-            tmp = pd.DataFrame([[last,ticker+"_pred",df.loc[row_id,"close_price"]]],columns=cols)
-            df = pd.concat([df,tmp],ignore_index=True,axis=0)
-
-    out = pd.concat([df,forecast],ignore_index=True,axis=0)
-
+        last_close = df[df["date"]==last].set_index("ticker")["close_price"].reindex(tickers)
+        frames.append(to_long_frame(last_close.to_numpy()[None,:],[last],tickers).assign(run_id=run_id))
+    frames.append(forecast.assign(run_id=run_id))
     if pred_historical is not None:
-        out = pd.concat([out,pred_historical],ignore_index=True,axis=0)
+        frames.append(pred_historical.assign(run_id=ONE_STEP_RUN))
+
+    out = pd.concat(frames,ignore_index=True,axis=0).assign(published_at=utc_now())
     
-    out.to_sql(name="small_daily",con=conn, if_exists="replace",index=False)
+    store.upsert_table("small_daily",out,SMALL_DAILY_KEYS,replace=True)
+    return out
+
+def publish_incremental(store,model,dataset,forecast):
+    # upserts only actuals and one-step predictions newer than what small_daily holds, plus this run's
+    # forecast; forecasts of earlier runs stay under their own run_id for accuracy tracking
+    last_actual = store.max_value("small_daily","date",[("run_id","=",ACTUAL_RUN)])
+    last_pred = store.max_value("small_daily","date",[("run_id","=",ONE_STEP_RUN)])
+    # full bars are only read for the new days
+    actual = store.read_daily(tickers=list(dataset.tickers_config.keys()),start=last_actual)
+    if last_actual is not None:
+        actual = actual[actual["date"] > last_actual]
+    actual = actual.sort_values(["date","ticker"],ignore_index=True)
+    pred_historical = predict_historical_data(model,dataset,since=last_pred)
+
+    out = pd.concat([
+        actual.assign(run_id=ACTUAL_RUN),
+        forecast.assign(run_id=dataset.data_index[-1]),
+        pred_historical.assign(run_id=ONE_STEP_RUN),
+    ],ignore_index=True,axis=0).assign(published_at=utc_now())
+
+    store.upsert_table("small_daily",out,SMALL_DAILY_KEYS)
+    print(f"Published {len(actual)} actual, {len(forecast)} forecast and {len(pred_historical)} prediction rows")
     return out
 
-def main():
+def main(store=None):
+    # store can be shared with other stages (see pipeline.py), it is only closed when opened here
     print("Start forecasting")
     script_folder = Path(__file__).resolve().parent
-    sql_scripts_folder = os.path.join(script_folder,"sql_scripts")
     env_path = os.path.join(script_folder.parent,".env")
     load_dotenv(env_path)
     data_folder = os.environ.get("DATA_FOLDER")
     models_folder = os.path.join(data_folder,"models")
 
-    db_file = os.path.join(data_folder,"stock.db")
-    conn = sqlite3.connect(db_file)
-    sql_path = os.path.join(sql_scripts_folder,"query_daily.sql")
+    own_store = store is None
+    if own_store:
+        store = get_store(data_folder)
     tickers_config_path = os.path.join(models_folder,"tickers_config.json")
     train_config_path = os.path.join(models_folder,"train_config.json")
     model_path = os.path.join(models_folder,"model.pt")
     model_config_path = os.path.join(models_folder,"model_config.json")
 
     # load data and create initial inference dataset
-    df = load_db_data(conn,sql_path)
+    with open(train_config_path,"r") as f:
+        tickers, start = universe(json.load(f))
+    df = load_db_data(store,tickers,start=start)
 
     # trainer will also check date
     trainer(df,model_config_path,model_path,models_folder,train_config_path)
     
-    # load inference dataset
-    dataset = load_inference_data(df,tickers_config_path,train_config_path)
     # load model artifact
-    model = load_model(model_config_path,model_path)
+    model, tickers_config = load_forecaster(models_folder,model_config_path,model_path,train_config_path)
+    # load inference dataset
+    dataset = load_inference_data(df,tickers_config_path,train_config_path,tickers_config)
 
-    # predict historical data
-    pred_historical = predict_historical_data(model,dataset)
     # forecast
-    forecast = forecast_next_n(model,dataset)
-    # write to db
-    write_to_db(conn,dataset,df,forecast,pred_historical)
+    with open(train_config_path,"r") as f:
+        horizon = json.load(f).get("horizon",5)
+    forecast = forecast_next_n(model,dataset,n=horizon)
+    # write to db, incremental publishes only what is new since the last run
+    if os.environ.get("PUBLISH_MODE","incremental") == "full":
+        pred_historical = predict_historical_data(model,dataset)
+        actual = store.read_daily(tickers=list(dataset.tickers_config.keys()),start=start)
+        write_to_db(store,dataset,actual.sort_values(["date","ticker"],ignore_index=True),forecast,pred_historical)
+    else:
+        publish_incremental(store,model,dataset,forecast)
+    if own_store:
+        store.close()
 
     print("End forecasting")
 
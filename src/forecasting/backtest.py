@@ -0,0 +1,194 @@
+"""
+Walk-forward backtest and benchmark for the forecasting models
+Each fold trains on the history before a cut-off date and forecasts the
+following days, folds run in parallel processes
+
+Run from src/, e.g.
+    python -m forecasting.backtest --synthetic --folds 4 --workers 4
+"""
+import os
+import time
+import json
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import torch
+
+from forecasting.data_prep import DataPrep, apply_missing_policy, pivot_close
+from forecasting.models import build_model
+
+
+def synthetic_daily(n_tickers=5,n_days=750,seed=0,start="2020-01-02"):
+    # geometric random walks on NYSE trading days, same columns as the daily table reads
+    from trading_calendar import next_trading_days
+    days = next_trading_days(pd.Timestamp(start).date()-pd.Timedelta(days=1),n_days)
+    rng = np.random.default_rng(seed)
+    tickers = [f"SYN{i}" for i in range(n_tickers)]
+    returns = rng.normal(0.0003,0.02,size=(len(days),n_tickers))
+    prices = 100*np.exp(np.cumsum(returns,axis=0))
+    return pd.DataFrame({
+        "date":np.repeat([day.isoformat() for day in days],n_tickers),
+        "ticker":np.tile(tickers,len(days)),
+        "close_price":prices.reshape(-1),
+    })
+
+
+def make_folds(n_dates,n_folds,test_size,window_size,horizon,mode="expanding",train_size=250):
+    # (train_start, cut) row ranges: train on [train_start, cut), forecast from origins in [cut-1, cut-1+test_size)
+    if mode == "rolling" and train_size is None:
+        raise ValueError("Rolling folds need a train_size")
+    folds = []
+    for k in range(n_folds):
+        cut = n_dates - horizon - (n_folds-k)*test_size + 1
+        train_start = 0 if mode == "expanding" else max(cut-train_size,0)
+        if cut - train_start <= window_size:
+            continue
+        folds.append((train_start,cut))
+    return folds
+
+
+def run_fold(df,dates,fold,model_config,window_size,horizon,test_size,epochs,batch_size,threads=1):
+    torch.set_num_threads(threads)
+    train_start, cut = fold
+    train_df = df[df["date"].isin(dates[train_start:cut])]
+
+    start = time.perf_counter()
+    train_dataset = DataPrep(train_df,window_size)
+    tickers = list(train_dataset.tickers_config.keys())
+    if model_config.get("model_type") == "global_lstm":
+        model = build_model({"tickers":tickers,**model_config})
+        loader = train_dataset.get_loader(batch_size=batch_size,series_ids=model.ticker_ids(tickers))
+    else:
+        model = build_model({"input_size":len(tickers),**model_config})
+        loader = train_dataset.get_loader(batch_size=batch_size)
+    model.train_fn(loader,epochs)
+    train_seconds = time.perf_counter()-start
+
+    # inference on the full history with the fold's training stats, forecasts from every test origin;
+    # test dates are mapped to dataset rows by date, the dataset may not start where dates does
+    start = time.perf_counter()
+    dataset = DataPrep(df,window_size,tickers_config=train_dataset.tickers_config)
+    n = len(dataset.data_index)
+    rows = {date: i for i, date in enumerate(dataset.data_index)}
+    origins = [rows[date] for date in dates[cut-1:cut-1+test_size] if date in rows]
+    origins = [o for o in origins if window_size-1 <= o and o+horizon < n]
+    if not origins:
+        print(f"No forecast origins in the dataset for the fold cut at {dates[cut-1]}, skipping")
+        pred = np.empty((0,horizon,len(tickers)))
+    else:
+        mean, std = dataset.normalization()
+        pred = model.forecast(dataset.origin_windows(origins),horizon,mean,std,tickers).numpy() # (B,h,C)
+    predict_seconds = time.perf_counter()-start
+
+    steps = np.asarray(origins,dtype=np.int64).reshape(-1,1)+np.arange(1,horizon+1)
+    actual = dataset.data.numpy()[steps] # (B,h,C)
+    errors = pd.DataFrame({
+        "fold":fold[1],
+        "origin_date":np.repeat(np.asarray(dataset.data_index,dtype=object)[origins],horizon*len(tickers)),
+        "horizon":np.tile(np.repeat(np.arange(1,horizon+1),len(tickers)),len(origins)),
+        "ticker":np.tile(tickers,len(origins)*horizon),
+        "pred":pred.reshape(-1),
+        "actual":actual.reshape(-1),
+    })
+    timing = {
+        "fold":fold[1],
+        "train_start":dates[train_start],
+        "cut_date":dates[cut-1],
+        "train_windows":len(train_dataset),
+        "train_seconds":train_seconds,
+        # training windows processed per second across all epochs
+        "train_rows_per_sec":len(train_dataset)*epochs/max(train_seconds,1e-9),
+        "predict_seconds":predict_seconds,
+        "predict_rows_per_sec":pred.size/max(predict_seconds,1e-9),
+        # ru_maxrss is in KiB on linux
+        "peak_rss_mb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+    }
+    return errors, timing
+
+
+def summarize(errors):
+    # MAE/MAPE per ticker and horizon
+    errors = errors.assign(
+        abs_error=(errors["pred"]-errors["actual"]).abs(),
+    )
+    errors["ape"] = errors["abs_error"]/errors["actual"].abs()
+    summary = errors.groupby(["ticker","horizon"]).agg(
+        mae=("abs_error","mean"),
+        mape=("ape","mean"),
+        n=("abs_error","size"),
+    ).reset_index()
+    return summary
+
+
+def backtest(df,model_config,window_size=10,horizon=5,n_folds=4,test_size=20,mode="expanding",
+             train_size=250,epochs=50,batch_size=32,workers=1):
+    # dates that survive the missing-value policy, e.g. before a late-listed ticker's first close is dropped
+    dates = apply_missing_policy(pivot_close(df),"ffill").index.tolist()
+    folds = make_folds(len(dates),n_folds,test_size,window_size,horizon,mode,train_size)
+    start = time.perf_counter()
+    args = [(df,dates,fold,model_config,window_size,horizon,test_size,epochs,batch_size) for fold in folds]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(run_fold,*zip(*args)))
+    else:
+        results = [run_fold(*arg,threads=torch.get_num_threads()) for arg in args]
+    wall_seconds = time.perf_counter()-start
+
+    errors = pd.concat([errors for errors, _ in results],ignore_index=True)
+    timings = pd.DataFrame([timing for _, timing in results])
+    return summarize(errors), timings, wall_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="walk-forward backtest of the forecasting models")
+    parser.add_argument("--synthetic",action="store_true",help="use random-walk data instead of the daily store")
+    parser.add_argument("--tickers",type=int,default=5,help="number of synthetic tickers")
+    parser.add_argument("--days",type=int,default=750,help="number of synthetic trading days")
+    parser.add_argument("--window-size",type=int,default=10)
+    parser.add_argument("--horizon",type=int,default=5)
+    parser.add_argument("--folds",type=int,default=4)
+    parser.add_argument("--test-size",type=int,default=20,help="forecast origins per fold")
+    parser.add_argument("--mode",choices=["expanding","rolling"],default="expanding")
+    parser.add_argument("--train-size",type=int,default=250,help="training days per fold in rolling mode")
+    parser.add_argument("--epochs",type=int,default=50)
+    parser.add_argument("--batch-size",type=int,default=32)
+    parser.add_argument("--hidden-size",type=int,default=32)
+    parser.add_argument("--model",choices=["lstm","global_lstm"],default="lstm")
+    parser.add_argument("--workers",type=int,default=os.cpu_count() or 1)
+    parser.add_argument("--out",help="folder to write summary.csv and timings.csv")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        df = synthetic_daily(args.tickers,args.days)
+    else:
+        from pathlib import Path
+        from dotenv import load_dotenv
+        from daily_store import get_store
+        from forecast import load_db_data
+        load_dotenv(os.path.join(Path(__file__).resolve().parent.parent.parent,".env"))
+        store = get_store(os.environ.get("DATA_FOLDER"))
+        # folds slice long rows by date
+        df = load_db_data(store).stack().rename("close_price").reset_index()
+        store.close()
+
+    summary, timings, wall_seconds = backtest(
+        df,{"model_type":args.model,"hidden_size":args.hidden_size},
+        window_size=args.window_size,horizon=args.horizon,n_folds=args.folds,test_size=args.test_size,
+        mode=args.mode,train_size=args.train_size,epochs=args.epochs,batch_size=args.batch_size,workers=args.workers,
+    )
+    pd.set_option("display.width",200)
+    print(summary.to_string(index=False))
+    print(timings.to_string(index=False))
+    print(f"Backtest of {len(timings)} folds took {wall_seconds:.2f}s wall-clock")
+    if args.out:
+        os.makedirs(args.out,exist_ok=True)
+        summary.to_csv(os.path.join(args.out,"summary.csv"),index=False)
+        timings.to_csv(os.path.join(args.out,"timings.csv"),index=False)
+        with open(os.path.join(args.out,"run.json"),"w") as f:
+            json.dump({**vars(args),"wall_seconds":wall_seconds},f)
+
+
+if __name__ == "__main__":
+    main()
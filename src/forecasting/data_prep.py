@@ -1,96 +1,262 @@
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset
+import numpy as np
+import pandas as pd
 import torch
 import os
 import json
 
-def normalize(s):
-    return (s-s.mean())/s.std(), s.mean(), s.std()
+MISSING_POLICIES = ("ffill","drop","mask")
+
+def is_wide(df):
+    # a date x ticker close frame as built by pivot_close or forecast.load_db_data
+    return df.columns.name == "ticker"
+
+def pivot_close(df,tickers=None):
+    # long (date, ticker, close_price) rows -> dense date x ticker frame with a single scatter,
+    # a repeated (date, ticker) keeps its last row; a frame that is already wide passes through
+    if is_wide(df):
+        return df if tickers is None else df.reindex(columns=tickers)
+    date_codes, dates = pd.factorize(df["date"],sort=True)
+    ticker_codes, all_tickers = pd.factorize(df["ticker"],sort=True)
+    values = np.full((len(dates),len(all_tickers)),np.nan)
+    values[date_codes,ticker_codes] = df["close_price"].to_numpy(dtype=np.float64)
+    frame = pd.DataFrame(values,index=pd.Index(dates,name="date"),columns=pd.Index(all_tickers,name="ticker"))
+    if tickers is not None:
+        frame = frame.reindex(columns=tickers)
+    return frame
+
+def apply_missing_policy(frame,missing):
+    # ffill: carry the last close forward, dates before a ticker's first close are dropped
+    # drop: keep only dates where every ticker has a close
+    # mask: keep every date, gaps stay NaN and are reported through DataPrep.mask
+    if missing not in MISSING_POLICIES:
+        raise ValueError(f"missing must be one of {MISSING_POLICIES}, got {missing}")
+    if missing == "ffill":
+        return frame.ffill().dropna(how="any")
+    if missing == "drop":
+        return frame.dropna(how="any")
+    return frame
+
+def update_tickers_config(tickers_config,df,since=None,missing="ffill"):
+    # fold the close prices of rows after since into saved per-ticker stats as running statistics
+    # (parallel mean/variance update), so inputs keep their scale without recomputing them;
+    # the missing policy runs over all of df, so a gap on the first new day is filled from the
+    # last known close and the result matches a full recompute over the same rows
+    tickers = list(tickers_config.keys())
+    # closes may arrive as float32 (forecast.load_db_data), the stats accumulate in float64
+    frame = apply_missing_policy(pivot_close(df,tickers),missing).astype("float64")
+    if since is not None:
+        frame = frame[frame.index > since]
+    count_b = frame.count().to_numpy()
+    mean_b = frame.mean().to_numpy()
+    m2_b = frame.var(ddof=0).to_numpy()*count_b
+    updated = {}
+    for j, ticker in enumerate(tickers):
+        stats = tickers_config[ticker]
+        count_a = stats["count"]
+        if count_b[j] == 0:
+            updated[ticker] = dict(stats)
+            continue
+        count = count_a+count_b[j]
+        delta = mean_b[j]-stats["mean"]
+        m2 = stats["std"]**2*(count_a-1)+m2_b[j]+delta**2*count_a*count_b[j]/count
+        updated[ticker] = {
+            "mean":float(stats["mean"]+delta*count_b[j]/count),
+            "std":float(np.sqrt(m2/(count-1))),
+            "count":int(count),
+        }
+    return updated
+
+class WindowLoader:
+    # iterates a DataPrep in batches, each batch is one gather over the underlying tensors
+    def __init__(self,dataset,batch_size=8,shuffle=True,indices=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        # restrict to a subset of windows, e.g. a validation slice
+        self.indices = torch.arange(len(dataset)) if indices is None else torch.as_tensor(indices,dtype=torch.long)
+
+    def __len__(self):
+        return -(-len(self.indices)//self.batch_size)
+
+    def __iter__(self):
+        n = len(self.indices)
+        order = self.indices[shuffled_order(n)] if self.shuffle else self.indices
+        for start in range(0,n,self.batch_size):
+            yield self.dataset[order[start:start+self.batch_size]]
+
+def shuffled_order(n):
+    # the same draws from the global RNG as DataLoader(shuffle=True), so seeded runs see the same batches:
+    # the iterator takes a base seed first, then RandomSampler seeds its own generator for randperm
+    torch.empty((),dtype=torch.int64).random_()
+    generator = torch.Generator()
+    generator.manual_seed(int(torch.empty((),dtype=torch.int64).random_().item()))
+    return torch.randperm(n,generator=generator)
+
+class SeriesLoader:
+    # long-format batches for GlobalLSTMModel: every (window start, ticker) pair is one sample,
+    # yields ((B,W) normalized series, (B,) ticker ids, (B,) normalized next value)
+    def __init__(self,dataset,series_ids,batch_size=256,shuffle=True,pairs=None):
+        self.dataset = dataset
+        self.series_ids = torch.as_tensor(series_ids,dtype=torch.long) # (C,) id of each column
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.starts, self.cols = dataset.series_pairs() if pairs is None else pairs
+
+    def __len__(self):
+        return -(-len(self.starts)//self.batch_size)
+
+    def __iter__(self):
+        n = len(self.starts)
+        order = torch.randperm(n) if self.shuffle else torch.arange(n)
+        windows = self.dataset.windows
+        data = self.dataset.data_normalized
+        window_size = self.dataset.window_size
+        for start in range(0,n,self.batch_size):
+            ix = order[start:start+self.batch_size]
+            starts, cols = self.starts[ix], self.cols[ix]
+            yield windows[starts,:,cols], self.series_ids[cols], data[starts+window_size,cols]
 
 class DataPrep(Dataset):
-    def __init__(self,df,window_size,tickers_config_path=None):
+    def __init__(self,df,window_size,tickers_config_path=None,missing="ffill",tickers_config=None,with_targets=None):
+        # stats come from tickers_config(_path) when given, otherwise they are computed from df;
+        # targets are built by default only when the stats are computed (training)
         self.window_size = window_size
-        self.data_index = df["date"].sort_values().unique().tolist()
+        self.missing = missing
         self.tickers_config_path = tickers_config_path
-        if not tickers_config_path:
+        if tickers_config_path:
+            with open(tickers_config_path) as f:
+                tickers_config = json.load(f)
+        self.with_targets = tickers_config is None if with_targets is None else with_targets
+        if tickers_config is None:
             self.tickers_config, self.data, self.data_normalized = self._generate_train_data(df)
-            self.windows_targets = self._generate_windowstargets()
         else:
-            with open(tickers_config_path) as f:
-                self.tickers_config = json.load(f)
-            # in inference time, we don't need the data for target
+            self.tickers_config = tickers_config
             self.data, self.data_normalized = self._generate_inference_data(df)
+        if self.with_targets:
+            self.windows, self.targets = self._generate_windowstargets()
+        else:
+            # in inference time, we don't need the data for target
             self.windows = self._generate_windows()
 
         
     
     def _generate_inference_data(self,df):
-        tensors = []
-        tensors_normalized = []
-        for ticker in self.tickers_config:
-            series = df[df["ticker"]==ticker][["date","close_price"]]
-            series.sort_values(by="date",inplace=True)
-            series.set_index("date",inplace=True)
-            series = series["close_price"]
-
-            tensor = torch.tensor(series.values, dtype=torch.float32).unsqueeze(1)
-            tensors.append(tensor)
-
-            series_normalized = (series - self.tickers_config[ticker]["mean"])/self.tickers_config[ticker]["std"]
-            tensor_normalized = torch.tensor(series_normalized.values, dtype=torch.float32).unsqueeze(1)
-            tensors_normalized.append(tensor_normalized)
-        return torch.cat(tensors, dim = -1),torch.cat(tensors_normalized, dim = -1)
-    
+        frame = self._pivot(df,list(self.tickers_config.keys()))
+        mean = np.array([self.tickers_config[ticker]["mean"] for ticker in frame.columns])
+        std = np.array([self.tickers_config[ticker]["std"] for ticker in frame.columns])
+        return self._to_tensors(frame,mean,std)
+
+    def _pivot(self,df,tickers=None):
+        frame = apply_missing_policy(pivot_close(df,tickers),self.missing)
+        self.data_index = frame.index.tolist()
+        # True where a close price was observed
+        self.mask = torch.tensor(frame.notna().to_numpy())
+        return frame
+
+    def _to_tensors(self,frame,mean,std):
+        values = frame.to_numpy()
+        normalized = (values-mean)/std
+        if self.missing == "mask":
+            # gaps sit at the ticker mean, i.e. 0 once normalized
+            values = np.where(np.isnan(values),mean,values)
+            normalized = np.nan_to_num(normalized,nan=0.0)
+        data = torch.from_numpy(values.astype(np.float32))
+        data_normalized = torch.from_numpy(normalized.astype(np.float32))
+        return data, data_normalized
+
     def _generate_windows(self):
-        return [self.data_normalized[i:i+self.window_size] for i in range(len(self.data_normalized)-self.window_size)]
+        # (N, window_size, C) strided view over data_normalized, nothing is copied
+        data = self.data_normalized.contiguous()
+        n = max(len(data)-self.window_size,0)
+        channels = data.shape[1]
+        return torch.as_strided(data,(n,self.window_size,channels),(channels,channels,1))
 
     def _generate_train_data(self, df):
-        tickers = sorted(df["ticker"].unique().tolist())
-        tickers_config = {}
-        tensors = []
-        tensors_normalized = []
-        for ticker in tickers:
-            series = df[df["ticker"]==ticker][["date","close_price"]]
-            series.sort_values(by="date",inplace=True)
-            series.set_index("date",inplace=True)
-            series = series["close_price"]
-            self.data_index = series.index.tolist()
-            
-            tensor = torch.tensor(series.values, dtype=torch.float32).unsqueeze(1)
-            tensors.append(tensor)
-            series_normalized, series_mean, series_std = normalize(series)
-            # record mean and std for later inference
-            tickers_config[ticker] = {"mean":series_mean,"std":series_std}
-
-            tensor_normalized = torch.tensor(series_normalized.values, dtype=torch.float32).unsqueeze(1)
-            tensors_normalized.append(tensor_normalized)
-        return tickers_config, torch.cat(tensors, dim = -1), torch.cat(tensors_normalized, dim = -1)
+        tickers = sorted(df.columns if is_wide(df) else df["ticker"].unique().tolist())
+        frame = self._pivot(df,tickers)
+        # per-ticker stats in one pass, recorded for later inference; float64 even for a float32 frame,
+        # only the model tensors are float32
+        stats_frame = frame.astype("float64")
+        mean = stats_frame.mean().to_numpy()
+        std = stats_frame.std().to_numpy()
+        # count lets incremental training update the stats later
+        count = stats_frame.count().to_numpy()
+        tickers_config = {
+            ticker: {"mean":float(mean[j]),"std":float(std[j]),"count":int(count[j])} for j, ticker in enumerate(tickers)
+        }
+        data, data_normalized = self._to_tensors(frame,mean,std)
+        return tickers_config, data, data_normalized
     
     def _generate_windowstargets(self):
-        return [
-            (self.data_normalized[i:i+self.window_size],
-             self.data[i+self.window_size]
-            ) for i in range(len(self.data_normalized)-self.window_size)
-        ]
+        # window i is data_normalized[i:i+window_size], its target the next raw close
+        windows = self._generate_windows()
+        return windows, self.data[self.window_size:self.window_size+len(windows)]
     
     def __len__(self):
-        if not self.tickers_config_path:
-            return len(self.windows_targets)
-        else:
-            return len(self.windows)
+        return len(self.windows)
 
     def __getitem__(self,ix):
-        if not self.tickers_config_path:
-            window, target = self.windows_targets[ix]
-            return window, target
+        # ix can be an int or a tensor of indices, a tensor gathers the whole batch at once
+        if torch.is_tensor(ix):
+            windows = self.windows.index_select(0,ix)
+            if self.with_targets:
+                return windows, self.targets.index_select(0,ix)
+            return windows
+        if self.with_targets:
+            return self.windows[ix], self.targets[ix]
         else:
-            window = self.windows[ix]
-            return window
+            return self.windows[ix]
         
     
-    def get_loader(self,batch_size=8,shuffle=True):
-        dataloader = DataLoader(self, batch_size=batch_size, shuffle=shuffle)
-        return dataloader
+    def get_loader(self,batch_size=8,shuffle=True,series_ids=None):
+        # series_ids (one model id per column) switches to long-format SeriesLoader batches
+        if series_ids is not None:
+            return SeriesLoader(self,series_ids,batch_size=batch_size,shuffle=shuffle)
+        return WindowLoader(self,batch_size=batch_size,shuffle=shuffle)
+
+    def get_split_loaders(self,val_fraction=0.1,batch_size=8,series_ids=None):
+        # chronological holdout: the last val_fraction of windows validate, the rest train
+        n = len(self)
+        n_val = int(n*val_fraction)
+        if n_val == 0:
+            return self.get_loader(batch_size=batch_size,series_ids=series_ids), None
+        if series_ids is not None:
+            starts, cols = self.series_pairs()
+            train = starts < n-n_val
+            train_loader = SeriesLoader(self,series_ids,batch_size,True,(starts[train],cols[train]))
+            val_loader = SeriesLoader(self,series_ids,batch_size,False,(starts[~train],cols[~train]))
+            return train_loader, val_loader
+        train_loader = WindowLoader(self,batch_size=batch_size,shuffle=True,indices=range(n-n_val))
+        val_loader = WindowLoader(self,batch_size=batch_size,shuffle=False,indices=range(n-n_val,n))
+        return train_loader, val_loader
+
+    def series_pairs(self):
+        # (start, column) of every window whose days and target were all observed, date-major;
+        # with missing="mask" tickers with short or gappy histories still contribute their full windows
+        span = self.window_size+1
+        observed = torch.cat([torch.zeros(1,self.mask.shape[1],dtype=torch.int64),self.mask.long().cumsum(0)])
+        complete = (observed[span:]-observed[:-span]) == span
+        return complete.nonzero(as_tuple=True)
     
+    def normalization(self):
+        # (C,) mean and std tensors in column order
+        mean = torch.tensor([self.tickers_config[ticker]["mean"] for ticker in self.tickers_config],dtype=torch.float32)
+        std = torch.tensor([self.tickers_config[ticker]["std"] for ticker in self.tickers_config],dtype=torch.float32)
+        return mean, std
+
+    def origin_windows(self,origins=None):
+        # normalized windows ending at the given row positions (default: the last row),
+        # one per forecast origin, as a (B, window_size, C) tensor
+        data = self.data_normalized.contiguous()
+        channels = data.shape[1]
+        n = len(data)-self.window_size+1
+        all_windows = torch.as_strided(data,(n,self.window_size,channels),(channels,channels,1))
+        if origins is None:
+            origins = [len(data)-1]
+        starts = torch.as_tensor(origins,dtype=torch.long)-self.window_size+1
+        return all_windows.index_select(0,starts)
+
     def save_tickers(self,save_folder):
         with open(os.path.join(save_folder,"tickers_config.json"),"w") as f:
             json.dump(self.tickers_config,f)
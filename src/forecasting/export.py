@@ -0,0 +1,129 @@
+"""
+Inference artifact for the forecasting models
+The trained model is written as one TorchScript file, optionally with dynamic int8
+quantization of its LSTM/Linear layers, with versioned metadata embedded in the file.
+The forecaster loads it without rebuilding the model class from JSON
+"""
+import json
+import datetime
+import warnings
+import torch
+from torch import nn
+
+from forecasting.models import LSTMModel, GlobalLSTMModel
+
+ARTIFACT_NAME = "model.ts"
+METADATA_FILE = "metadata.json"
+FORMAT_VERSION = 1
+# max relative error against the eager model
+TOLERANCE = 1e-4
+QUANTIZED_TOLERANCE = 5e-2
+
+
+class LSTMForecaster(nn.Module):
+    # scriptable LSTMModel.forecast, ids is unused
+    def __init__(self,model):
+        super().__init__()
+        self.lstm_layer = model.lstm_layer
+        self.fc = model.fc
+
+    def forward(self,x,n: int,mean,std,ids):
+        _, (h,c) = self.lstm_layer(x)
+        preds = []
+        for step in range(n):
+            pred = self.fc(h[-1])
+            preds.append(pred)
+            _, (h,c) = self.lstm_layer(((pred-mean)/std).unsqueeze(1),(h,c))
+        return torch.stack(preds,dim=1)
+
+
+class GlobalLSTMForecaster(nn.Module):
+    # scriptable GlobalLSTMModel.forecast, ids are the model ids of the C columns
+    def __init__(self,model):
+        super().__init__()
+        self.embedding = model.embedding
+        self.lstm_layer = model.lstm_layer
+        self.fc = model.fc
+
+    def forward(self,x,n: int,mean,std,ids):
+        B, T, C = x.shape
+        series = x.permute(0,2,1).reshape(B*C,T)
+        emb = self.embedding(ids.repeat(B)).unsqueeze(1)
+        _, (h,c) = self.lstm_layer(torch.cat([series.unsqueeze(-1),emb.expand(-1,T,-1)],dim=-1))
+        preds = []
+        for step in range(n):
+            pred = self.fc(h[-1])
+            preds.append(pred)
+            _, (h,c) = self.lstm_layer(torch.cat([pred.unsqueeze(1),emb],dim=-1),(h,c))
+        pred = torch.cat(preds,dim=1).reshape(B,C,n).permute(0,2,1)
+        return pred*std+mean
+
+
+FORECASTERS = {LSTMModel:LSTMForecaster,GlobalLSTMModel:GlobalLSTMForecaster}
+
+
+class ExportedModel:
+    # loaded artifact with the forecast() interface of the eager models
+    def __init__(self,module,metadata):
+        self.module = module
+        self.metadata = metadata
+        tickers = metadata["model_config"].get("tickers") or []
+        self.ticker_index = {ticker: i+1 for i, ticker in enumerate(tickers)}
+
+    def forecast(self,x,n,mean,std,tickers=None):
+        ids = torch.tensor([self.ticker_index.get(ticker,0) for ticker in tickers or []],dtype=torch.long)
+        with torch.inference_mode():
+            return self.module(x,n,mean,std,ids)
+
+
+def script_model(model,quantize=False):
+    module = FORECASTERS[type(model)](model).eval()
+    # TorchScript and eager quantization are deprecated upstream but still the fastest CPU path here
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if quantize:
+            module = torch.ao.quantization.quantize_dynamic(module,{nn.LSTM,nn.Linear},dtype=torch.qint8)
+        return torch.jit.script(module)
+
+
+def parity_error(model,exported,x,mean,std,tickers=None,n=5):
+    # max relative difference between the eager and the exported forecasts
+    expected = model.forecast(x,n,mean,std,tickers)
+    actual = exported.forecast(x,n,mean,std,tickers)
+    return float(((actual-expected).abs()/expected.abs().clamp_min(1e-6)).max())
+
+
+def export_model(model,path,metadata,quantize=False,example=None,tolerance=None):
+    # example: (x, mean, std, tickers) inputs for the parity check, the file is only written if it passes
+    module = script_model(model,quantize)
+    metadata = {
+        "format_version":FORMAT_VERSION,
+        "model_config":model.config,
+        "quantized":quantize,
+        "torch_version":torch.__version__,
+        "exported_at":datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        **metadata,
+    }
+    if example is not None:
+        x, mean, std, tickers = example
+        error = parity_error(model,ExportedModel(module,metadata),x,mean,std,tickers)
+        if tolerance is None:
+            tolerance = QUANTIZED_TOLERANCE if quantize else TOLERANCE
+        if error > tolerance:
+            raise RuntimeError(f"exported model differs from the eager model by {error:.2e} > {tolerance:.0e}")
+        metadata["parity_error"] = error
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore",FutureWarning)
+        torch.jit.save(module,path,_extra_files={METADATA_FILE:json.dumps(metadata)})
+    return metadata
+
+
+def load_exported(path):
+    extra_files = {METADATA_FILE:""}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore",FutureWarning)
+        module = torch.jit.load(path,_extra_files=extra_files)
+    metadata = json.loads(extra_files[METADATA_FILE])
+    if metadata.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version: {metadata.get('format_version')}")
+    return ExportedModel(module,metadata)
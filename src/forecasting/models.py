@@ -3,44 +3,122 @@ from torch import nn
 import os
 import json
 
-class LSTMModel(nn.Module):
-    def __init__(self, input_size,hidden_size):
-        torch.manual_seed(0)
-        super().__init__()
-        self.config = {"input_size":input_size,"hidden_size":hidden_size}
-        self.lstm_layer = nn.LSTM(input_size=input_size, hidden_size=hidden_size,batch_first=True)
-        self.fc = nn.Linear(hidden_size, input_size)
+def configure_threads(num_threads=None,interop_threads=None):
+    # intra-op threads can change at any time, inter-op threads only before the first parallel op
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as err:
+            print(f"Could not set interop threads: {err}")
 
-    def forward(self, x):
-        _, x = self.lstm_layer(x)
-        x = self.fc(x[0]).squeeze(0)
-        return x
+class ForecastModel(nn.Module):
+    # training engine and persistence shared by the model families,
+    # a batch is (*inputs, target) and the model is called as self(*inputs)
+    series_input = False
 
-    def train_fn(self,dataloader,epochs=1000):
+    def train_fn(self,dataloader,epochs=1000,val_loader=None,lr=0.01,patience=None,
+                 scheduler_patience=None,checkpoint_path=None,checkpoint_every=50,log_every=100,run_info=None):
+        # early stopping and the LR scheduler watch the validation loss (training loss without val_loader);
+        # the best weights are restored at the end, an existing checkpoint is resumed only if it was
+        # written by the same run (run_info, e.g. train mode, epochs, watermark and tickers)
         torch.manual_seed(0)
-        self.train()
         loss_fn = nn.L1Loss()
-        optimizer = torch.optim.Adam(params=self.parameters(),lr=0.01)
-        for epoch in range(epochs):
-            train_iter = iter(dataloader)
-            epoch_loss = 0
-            for batch, (X,y) in enumerate(train_iter):
+        optimizer = torch.optim.Adam(params=self.parameters(),lr=lr)
+        scheduler = None
+        if scheduler_patience is not None:
+            scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer,factor=0.5,patience=scheduler_patience)
+        state = {"epoch":0,"best_loss":float("inf"),"best_state":None,"bad_epochs":0}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            resumed = self._load_checkpoint(checkpoint_path,optimizer,scheduler,run_info)
+            if resumed is None:
+                print("Checkpoint is from another training run, starting from scratch")
+                os.remove(checkpoint_path)
+            else:
+                state = resumed
+                print(f"Resuming training from epoch {state['epoch']}")
+
+        for epoch in range(state["epoch"],epochs):
+            self.train()
+            # accumulate on device, one host sync per epoch instead of per batch
+            epoch_loss = torch.zeros(())
+            for *X, y in dataloader:
                 optimizer.zero_grad()
-                yhat = self(X)
+                yhat = self(*X)
                 loss = loss_fn(yhat,y)
-                epoch_loss += loss.item()
+                epoch_loss += loss.detach()
                 loss.backward()
                 optimizer.step()
-            epoch_loss = epoch_loss/len(train_iter)
-            if epoch % 100 == 0:
-                print(f"Epoch {epoch} loss: {epoch_loss}")
+            epoch_loss = epoch_loss.item()/len(dataloader)
+            monitored = self.evaluate(val_loader,loss_fn) if val_loader is not None else epoch_loss
+            if scheduler is not None:
+                scheduler.step(monitored)
+
+            if monitored < state["best_loss"]:
+                state["best_loss"] = monitored
+                state["best_state"] = {key: value.detach().clone() for key, value in self.state_dict().items()}
+                state["bad_epochs"] = 0
+            else:
+                state["bad_epochs"] += 1
+            state["epoch"] = epoch+1
+
+            if epoch % log_every == 0:
+                val_msg = f", val loss: {monitored}" if val_loader is not None else ""
+                print(f"Epoch {epoch} loss: {epoch_loss}{val_msg}")
+            if checkpoint_path and state["epoch"] % checkpoint_every == 0:
+                self._save_checkpoint(checkpoint_path,optimizer,scheduler,state,run_info)
+            if patience is not None and state["bad_epochs"] >= patience:
+                print(f"Early stopping at epoch {epoch}, best loss: {state['best_loss']}")
+                break
 
-    def predict(self,x):
+        if state["best_state"] is not None:
+            self.load_state_dict(state["best_state"])
+        # a finished run must not be resumed by the next one
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return {"epochs":state["epoch"],"best_loss":state["best_loss"]}
+
+    def evaluate(self,dataloader,loss_fn=None):
+        loss_fn = loss_fn or nn.L1Loss()
         self.eval()
+        total = torch.zeros(())
         with torch.inference_mode():
-            pred = self(x)
+            for *X, y in dataloader:
+                total += loss_fn(self(*X),y)
+        return total.item()/len(dataloader)
+
+    def _save_checkpoint(self,checkpoint_path,optimizer,scheduler,state,run_info=None):
+        checkpoint = {
+            "run_info":run_info,
+            "model":self.state_dict(),
+            "optimizer":optimizer.state_dict(),
+            "scheduler":scheduler.state_dict() if scheduler is not None else None,
+            "rng":torch.get_rng_state(),
+            **state,
+        }
+        # write then rename, so an interruption never leaves a truncated checkpoint
+        torch.save(checkpoint,checkpoint_path+".tmp")
+        os.replace(checkpoint_path+".tmp",checkpoint_path)
+
+    def _load_checkpoint(self,checkpoint_path,optimizer,scheduler,run_info=None):
+        # None when the checkpoint belongs to another run, nothing is loaded then
+        checkpoint = torch.load(checkpoint_path,weights_only=False)
+        if checkpoint.get("run_info") != run_info:
+            return None
+        self.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        if scheduler is not None and checkpoint["scheduler"] is not None:
+            scheduler.load_state_dict(checkpoint["scheduler"])
+        torch.set_rng_state(checkpoint["rng"])
+        return {key: checkpoint[key] for key in ("epoch","best_loss","best_state","bad_epochs")}
+
+    def predict(self,*x):
+        self.eval()
+        with torch.inference_mode():
+            pred = self(*x)
         return pred
-    
+
     def save_model(self,save_folder):
         # save state_dict
         torch.save(self.state_dict(),os.path.join(save_folder,"model.pt"))
@@ -52,5 +130,90 @@ class LSTMModel(nn.Module):
 
     def load_model(self,model_path):
         self.load_state_dict(torch.load(model_path))
-    
-    
\ No newline at end of file
+
+
+class LSTMModel(ForecastModel):
+    # joint model, the tickers are the channels of one wide series
+    def __init__(self, input_size,hidden_size):
+        torch.manual_seed(0)
+        super().__init__()
+        self.config = {"input_size":input_size,"hidden_size":hidden_size}
+        self.lstm_layer = nn.LSTM(input_size=input_size, hidden_size=hidden_size,batch_first=True)
+        self.fc = nn.Linear(hidden_size, input_size)
+
+    def forward(self, x):
+        _, x = self.lstm_layer(x)
+        x = self.fc(x[0]).squeeze(0)
+        return x
+
+    def forecast(self,x,n,mean,std,tickers=None):
+        # x: (B,T,C) normalized windows, one per forecast origin, tickers is unused (the columns are fixed)
+        # returns (B,n,C) predictions; the hidden state is carried forward,
+        # so every step after the first is a single LSTM cell update
+        self.eval()
+        with torch.inference_mode():
+            _, (h,c) = self.lstm_layer(x)
+            preds = []
+            for _ in range(n):
+                pred = self.fc(h[-1])
+                preds.append(pred)
+                step = ((pred-mean)/std).unsqueeze(1)
+                _, (h,c) = self.lstm_layer(step,(h,c))
+        return torch.stack(preds,dim=1)
+
+
+class GlobalLSTMModel(ForecastModel):
+    # one LSTM shared by every ticker: each sample is a single ticker's normalized series plus
+    # a learned ticker embedding, so adding tickers adds samples rather than input width;
+    # id 0 is reserved for tickers that were not in the training vocabulary
+    series_input = True
+
+    def __init__(self,tickers,hidden_size,embedding_dim=8):
+        torch.manual_seed(0)
+        super().__init__()
+        self.config = {"model_type":"global_lstm","tickers":list(tickers),"hidden_size":hidden_size,"embedding_dim":embedding_dim}
+        self.ticker_index = {ticker: i+1 for i, ticker in enumerate(tickers)}
+        self.embedding = nn.Embedding(len(self.ticker_index)+1,embedding_dim)
+        self.lstm_layer = nn.LSTM(input_size=1+embedding_dim,hidden_size=hidden_size,batch_first=True)
+        self.fc = nn.Linear(hidden_size,1)
+
+    def ticker_ids(self,tickers):
+        return torch.tensor([self.ticker_index.get(ticker,0) for ticker in tickers],dtype=torch.long)
+
+    def _inputs(self,x,ids):
+        # (B,T) series and (B,) ids -> (B,T,1+embedding_dim)
+        emb = self.embedding(ids).unsqueeze(1).expand(-1,x.shape[1],-1)
+        return torch.cat([x.unsqueeze(-1),emb],dim=-1)
+
+    def forward(self,x,ids):
+        # next normalized value of each series
+        _, (h,_) = self.lstm_layer(self._inputs(x,ids))
+        return self.fc(h[-1]).squeeze(-1)
+
+    def forecast(self,x,n,mean,std,tickers=None):
+        # same contract as LSTMModel.forecast: x (B,T,C) normalized wide windows, returns (B,n,C) prices;
+        # the B*C columns run as independent series in one batch
+        B, T, C = x.shape
+        series = x.permute(0,2,1).reshape(B*C,T)
+        ids = self.ticker_ids(tickers).repeat(B)
+        self.eval()
+        with torch.inference_mode():
+            _, (h,c) = self.lstm_layer(self._inputs(series,ids))
+            emb = self.embedding(ids).unsqueeze(1)
+            preds = []
+            for _ in range(n):
+                pred = self.fc(h[-1])
+                preds.append(pred)
+                _, (h,c) = self.lstm_layer(torch.cat([pred.unsqueeze(1),emb],dim=-1),(h,c))
+        pred = torch.cat(preds,dim=1).reshape(B,C,n).permute(0,2,1)
+        return pred*std+mean
+
+
+MODEL_TYPES = {"lstm":LSTMModel,"global_lstm":GlobalLSTMModel}
+
+
+def build_model(model_config):
+    # model_config.json without "model_type" is the original joint LSTMModel
+    model_config = dict(model_config)
+    return MODEL_TYPES[model_config.pop("model_type","lstm")](**model_config)
+
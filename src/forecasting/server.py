@@ -0,0 +1,302 @@
+"""
+Local forecast server
+Keeps the model, tickers config and the latest windows in memory, micro-batches concurrent
+requests into single forecast passes, caches results per (ticker, as-of date, horizon),
+reloads when a training finishes and refreshes the windows when new days are loaded
+
+Run from src/, e.g.
+    python -m forecasting.server --port 8080
+    curl "localhost:8080/forecast?ticker=AAPL,META&horizon=5&as_of=2023-12-01"
+"""
+import os
+import json
+import time
+import queue
+import bisect
+import argparse
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from forecast import MODEL_MARKER, load_db_data, load_forecaster, load_inference_data, universe
+from trading_calendar import next_trading_days
+from daily_store import get_store
+
+# the trainer writes the marker after the model files and train_config.json, so a reload never sees
+# half of a training; models folders from before the marker fall back to train_config.json,
+# which was also written last
+VERSION_FILES = (MODEL_MARKER,"train_config.json")
+MAX_HORIZON = 60
+
+
+class ServingState:
+    # everything one model version needs to answer requests, swapped as a whole on reload
+    def __init__(self,model,dataset,version,tickers_config=None,data_version=None):
+        self.model = model
+        self.dataset = dataset
+        self.version = version
+        # exported artifacts carry their tickers config, None means tickers_config.json
+        self.tickers_config = tickers_config
+        self.data_version = data_version
+        self.tickers = list(dataset.tickers_config.keys())
+        self.columns = {ticker: j for j, ticker in enumerate(self.tickers)}
+        self.mean, self.std = dataset.normalization()
+        self.loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def origin(self,as_of=None):
+        # row of the last observed date on or before as_of
+        if as_of is None:
+            return len(self.dataset.data_index)-1
+        return bisect.bisect_right(self.dataset.data_index,as_of)-1
+
+
+class ForecastService:
+    def __init__(self,data_folder,max_batch=64,max_wait=0.005,poll_interval=5,cache_size=10000):
+        self.data_folder = data_folder
+        self.models_folder = os.path.join(data_folder,"models")
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # (ticker, as_of, horizon) -> forecast rows
+        self.cache_lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.state = None
+        self.stopped = threading.Event()
+        # opened once, used by start() and then only by the watch thread
+        self.store = get_store(data_folder)
+
+    def model_version(self):
+        for name in VERSION_FILES:
+            path = os.path.join(self.models_folder,name)
+            if os.path.exists(path):
+                return name, os.stat(path).st_mtime_ns
+        return None
+
+    def data_version(self):
+        # last loaded day of the daily table
+        return self.store.daily_bounds()[1]
+
+    def _load_dataset(self,tickers_config):
+        # (inference dataset, data version) from the daily table as it is now
+        train_config_path = os.path.join(self.models_folder,"train_config.json")
+        with open(train_config_path,"r") as f:
+            tickers, start = universe(json.load(f))
+        data_version = self.data_version()
+        df = load_db_data(self.store,tickers,start=start)
+        dataset = load_inference_data(df,os.path.join(self.models_folder,"tickers_config.json"),train_config_path,tickers_config)
+        return dataset, data_version
+
+    def _swap(self,state):
+        self.state = state
+        with self.cache_lock:
+            self.cache.clear()
+
+    def reload(self):
+        # build the new state completely before swapping it in, requests keep using the old one meanwhile
+        version = self.model_version()
+        model, tickers_config = load_forecaster(
+            self.models_folder,
+            os.path.join(self.models_folder,"model_config.json"),
+            os.path.join(self.models_folder,"model.pt"),
+            os.path.join(self.models_folder,"train_config.json"),
+        )
+        dataset, data_version = self._load_dataset(tickers_config)
+        self._swap(ServingState(model,dataset,version,tickers_config,data_version))
+        print(f"Loaded model version {version}, data up to {dataset.data_index[-1]}")
+
+    def refresh_data(self):
+        # new days without a new model: same model, windows rebuilt from the daily table
+        state = self.state
+        dataset, data_version = self._load_dataset(state.tickers_config)
+        self._swap(ServingState(state.model,dataset,state.version,state.tickers_config,data_version))
+        print(f"Refreshed data up to {dataset.data_index[-1]}")
+
+    def start(self):
+        self.reload()
+        threading.Thread(target=self._batch_loop,daemon=True).start()
+        threading.Thread(target=self._watch_loop,daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.requests.put(None)
+        self.store.close()
+
+    def _watch_loop(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                if self.model_version() != self.state.version:
+                    self.reload()
+                elif self.data_version() != self.state.data_version:
+                    self.refresh_data()
+            except Exception as err:
+                # a half-written model file or a busy store is retried on the next poll
+                print(f"Reload failed: {err}")
+
+    def _batch_loop(self):
+        # collect requests for up to max_wait seconds, then answer them with one forecast pass
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic()+self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline-time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.requests.put(None)
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self,batch):
+        # batch items are (state, origin row, horizon, future); the joint model forecasts every ticker
+        # of an origin at once, so a pass is over the distinct origins of one model version
+        states = {}
+        for item in batch:
+            states.setdefault(id(item[0]),[]).append(item)
+        for items in states.values():
+            try:
+                state = items[0][0]
+                origins = sorted({origin for _, origin, _, _ in items})
+                horizon = max(horizon for _, _, horizon, _ in items)
+                windows = state.dataset.origin_windows(origins)
+                pred = state.model.forecast(windows,horizon,state.mean,state.std,state.tickers)
+                position = {origin: b for b, origin in enumerate(origins)}
+                for _, origin, horizon, future in items:
+                    future.set_result(pred[position[origin],:horizon].numpy())
+            except Exception as err:
+                for *_, future in items:
+                    if not future.done():
+                        future.set_exception(err)
+
+    def forecast(self,tickers,horizon=5,as_of=None,timeout=30):
+        # {ticker: [{"date", "close_price"}]} for the horizon trading days after the as-of date
+        state = self.state
+        unknown = [ticker for ticker in tickers if ticker not in state.columns]
+        if unknown:
+            raise KeyError(f"Unknown tickers: {','.join(unknown)}")
+        if not 1 <= horizon <= MAX_HORIZON:
+            raise ValueError(f"horizon must be between 1 and {MAX_HORIZON}")
+        if as_of is not None:
+            as_of = datetime.date.fromisoformat(as_of).isoformat()
+        origin = state.origin(as_of)
+        if origin < state.dataset.window_size-1:
+            raise ValueError(f"Not enough history before {as_of}")
+        origin_date = state.dataset.data_index[origin]
+
+        result, missing = {}, []
+        with self.cache_lock:
+            for ticker in tickers:
+                key = (ticker,origin_date,horizon)
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    result[ticker] = self.cache[key]
+                else:
+                    missing.append(ticker)
+        if missing:
+            # other requests for the same origin batch with this one
+            future = Future()
+            self.requests.put((state,origin,horizon,future))
+            pred = future.result(timeout=timeout) # (horizon, C)
+            dates = [day.isoformat() for day in next_trading_days(origin_date,horizon)]
+            with self.cache_lock:
+                # the pass covered every ticker, cache them all unless a reload happened meanwhile
+                for ticker, j in state.columns.items():
+                    rows = [{"date":date,"close_price":float(price)} for date, price in zip(dates,pred[:,j])]
+                    if state is self.state:
+                        self.cache[(ticker,origin_date,horizon)] = rows
+                    if ticker in missing:
+                        result[ticker] = rows
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return {"as_of":origin_date,"horizon":horizon,"forecast":result}
+
+    def health(self):
+        state = self.state
+        return {
+            "loaded_at":state.loaded_at,
+            "data_until":state.dataset.data_index[-1],
+            "tickers":state.tickers,
+            "exported":hasattr(state.model,"metadata"),
+            "cache_entries":len(self.cache),
+        }
+
+
+def make_handler(service):
+    class ForecastHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            try:
+                if url.path == "/health":
+                    return self._send(200,service.health())
+                if url.path != "/forecast":
+                    return self._send(404,{"error":f"Unknown path: {url.path}"})
+                if "ticker" not in params:
+                    return self._send(400,{"error":"ticker is required"})
+                tickers = [ticker for value in params["ticker"] for ticker in value.split(",") if ticker]
+                horizon = int(params.get("horizon",["5"])[0])
+                as_of = params.get("as_of",[None])[0]
+                return self._send(200,service.forecast(tickers,horizon,as_of))
+            except KeyError as err:
+                return self._send(404,{"error":err.args[0]})
+            except ValueError as err:
+                return self._send(400,{"error":str(err)})
+            except Exception as err:
+                return self._send(500,{"error":str(err)})
+
+        def _send(self,status,body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type","application/json")
+            self.send_header("Content-Length",str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self,format,*args):
+            # keep per-request logging off the hot path
+            pass
+
+    return ForecastHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve forecasts over HTTP")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8080)
+    parser.add_argument("--max-batch",type=int,default=64,help="max requests per forecast pass")
+    parser.add_argument("--max-wait-ms",type=float,default=5,help="how long a pass waits for more requests")
+    parser.add_argument("--poll-seconds",type=float,default=5,help="how often to look for a new model")
+    args = parser.parse_args()
+
+    from pathlib import Path
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(Path(__file__).resolve().parent.parent.parent,".env"))
+    service = ForecastService(
+        os.environ.get("DATA_FOLDER"),max_batch=args.max_batch,
+        max_wait=args.max_wait_ms/1000,poll_interval=args.poll_seconds,
+    ).start()
+    server = ThreadingHTTPServer((args.host,args.port),make_handler(service))
+    print(f"Serving forecasts on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,25 @@
 import os
-import time
 import datetime
-import pandas as pd
 from dotenv import load_dotenv
 from api_models import GroupedDailyRequest
-from google.cloud import storage
+from fetcher import make_session, run_jobs
+from trading_calendar import trading_days
+from manifest import GCSManifest, LocalManifest
 from pathlib import Path
 
-def blob_exists(blob_name,bucket_name="stock-data-project-khoa"):
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    stats = storage.Blob(bucket=bucket,name=blob_name).exists(storage_client)
-    return stats
+def get_manifest(outdir):
+    # "gcs" lists the bucket prefix once, "local" lists outdir (for offline runs)
+    backend = os.environ.get("MANIFEST_BACKEND","gcs")
+    cache_path = os.environ.get("MANIFEST_CACHE")
+    # by default the storage is listed before every plan, other runs may have uploaded or deleted dates
+    max_age = float(os.environ.get("MANIFEST_CACHE_MAX_AGE",0))
+    if backend == "local":
+        return LocalManifest(outdir,cache_path=cache_path).load(max_age=max_age)
+    bucket_name = os.environ.get("BUCKET_NAME","stock-data-project-khoa")
+    return GCSManifest(bucket_name,prefix="grouped_daily_json/",cache_path=cache_path).load(max_age=max_age)
 
-def get_grouped_daily():
+def get_grouped_daily(session=None):
+    # session: a shared rate-limited session (see pipeline.py), returns the dates that failed
     # get environment variables
     script_folder = Path(__file__).resolve().parent # can also use os.path.dirname(__file__)
     env_path = os.path.join(script_folder.parent,".env")
@@ -21,6 +27,10 @@ def get_grouped_daily():
     api_key = os.environ.get("API_KEY")
     data_folder = os.environ.get("DATA_FOLDER")
     outdir = os.path.join(data_folder,"grouped_daily_json")
+    # free plan allows 5 requests per minute
+    requests_per_minute = float(os.environ.get("REQUESTS_PER_MINUTE",5))
+    max_workers = int(os.environ.get("MAX_WORKERS",4))
+    storage_format = os.environ.get("GROUPED_DAILY_FORMAT","parquet")
 
     # make dirs
     os.makedirs(data_folder,exist_ok=True)
@@ -30,21 +40,32 @@ def get_grouped_daily():
     start_date = os.environ.get("START_DATE")
     end_date = datetime.date.today()-datetime.timedelta(days=1)
 
-    timelist = pd.date_range(start=start_date,end=end_date).tolist()
-    # timelist = [ts for ts in timelist if ts.weekday() < 5]
-    datelist = [datetime.datetime.strftime(ts,r"%Y-%m-%d") for ts in timelist]
-
-
-    for date in datelist:
-        if blob_exists(blob_name=f"grouped_daily_json/{date}.json"):
-            print(f"{date} file already exists")
-            time.sleep(0.25)
-            continue
-        else:
-            print(f"{date} file to be requested")
-            GroupedDailyRequest(date=date,api_key=api_key,outdir=outdir)
-        if date != end_date:
-            time.sleep(13)
+    # weekends and NYSE holidays never have data, skip them before any I/O
+    datelist = [day.isoformat() for day in trading_days(start_date,end_date)]
+
+    manifest = get_manifest(outdir)
+    to_request = [date for date in datelist if not manifest.exists(date)]
+    print(f"{len(datelist)-len(to_request)} dates already exist, {len(to_request)} to be requested")
+
+    # the session paces requests, so workers never exceed the plan's rate limit
+    if session is None:
+        session = make_session(requests_per_minute=requests_per_minute,max_workers=max_workers)
+
+    def fetch(date):
+        print(f"{date} file to be requested")
+        request = GroupedDailyRequest(date=date,api_key=api_key,outdir=outdir,session=session,storage_format=storage_format)
+        return request.path if request.ok else None
+
+    results = run_jobs(fetch,to_request,max_workers=max_workers)
+    failed = sorted(date for date, path in results.items() if not isinstance(path,str))
+    for date, path in results.items():
+        if isinstance(path,str):
+            manifest.add(os.path.basename(path))
+    manifest.save()
+    print(f"Fetched {len(to_request)-len(failed)} of {len(to_request)} dates")
+    if failed:
+        print(f"Failed dates: {failed}")
+    return failed
 
 if __name__ == "__main__":
     get_grouped_daily()
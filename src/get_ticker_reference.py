@@ -1,56 +1,198 @@
 """
 This is a standalone script to obtain the list of tickers
+The crawl is split into shards by market (and optionally type) that page through their
+cursors concurrently under one shared rate limiter. Every page is written as it arrives,
+into the tickers table or one Parquet file per page, and the shard's cursor is checkpointed
+right after, so an interrupted run resumes from the last written page
 """
 import os
-import time
-import pandas as pd
+import json
+import shutil
+import threading
+import requests
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from api_models import TickerListRequest
+from fetcher import make_session, run_jobs
+from daily_store import get_store
 from pathlib import Path
 
-def get_ticker_json():
+# "market" or "market:type", e.g. "stocks:CS,stocks:ETF,crypto"
+DEFAULT_SHARDS = "stocks,otc,crypto,fx,indices"
+# same columns as create_tickers.sql
+TICKER_SCHEMA = pa.schema([
+    ("ticker",pa.string()),
+    ("name",pa.string()),
+    ("market",pa.string()),
+    ("locale",pa.string()),
+    ("active",pa.bool_()),
+    ("source_feed",pa.string()),
+    ("type",pa.string()),
+    ("composite_figi",pa.string()),
+    ("share_class_figi",pa.string()),
+    ("primary_exchange",pa.string()),
+    ("cik",pa.string()),
+    ("currency_name",pa.string()),
+    ("currency_symbol",pa.string()),
+    ("base_currency_name",pa.string()),
+    ("base_currency_symbol",pa.string()),
+    ("last_updated_utc",pa.string()),
+])
+PAGE_RETRIES = 3
+
+
+class Checkpoint:
+    # shard -> {"cursor", "pages", "rows", "done"}, rewritten atomically after every page
+    def __init__(self,path):
+        self.path = path
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        if self.exists():
+            with open(self.path,"r") as f:
+                self.shards = json.load(f)
+        return self
+
+    def get(self,shard):
+        return self.shards.get(shard,{"cursor":None,"pages":0,"rows":0,"done":False})
+
+    def update(self,shard,**state):
+        with self.lock:
+            self.shards[shard] = {**self.get(shard),**state}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path,"w") as f:
+                json.dump(self.shards,f)
+            os.replace(tmp_path,self.path)
+
+    def clear(self):
+        if self.exists():
+            os.remove(self.path)
+
+
+class TableSink:
+    # upserts every page into the store's tickers table by ticker
+    def __init__(self,store):
+        self.store = store
+        self.lock = threading.Lock()
+
+    def _upsert(self,df,replace=False):
+        # shard threads share one connection, one page is written at a time
+        with self.lock:
+            self.store.upsert_table("tickers",df,["ticker"],replace=replace)
+
+    def reset(self):
+        self._upsert(TICKER_SCHEMA.empty_table().to_pandas(),replace=True)
+
+    def write(self,shard,page_num,table):
+        self._upsert(table.to_pandas())
+
+
+class ParquetSink:
+    # one file per shard page, a retried page overwrites its own file
+    def __init__(self,folder):
+        self.folder = folder
+
+    def reset(self):
+        shutil.rmtree(self.folder,ignore_errors=True)
+        os.makedirs(self.folder,exist_ok=True)
+
+    def write(self,shard,page_num,table):
+        path = os.path.join(self.folder,f"{shard.replace(':','-')}-{page_num:05d}.parquet")
+        pq.write_table(table,path,compression="zstd")
+
+
+def shard_filters(shard):
+    market, _, ticker_type = shard.partition(":")
+    return market or None, ticker_type or None
+
+def fetch_page(request,retries=PAGE_RETRIES):
+    # the session already retries 429/5xx, this covers bodies cut off mid-transfer
+    for attempt in range(retries+1):
+        try:
+            return request.fetch()
+        except (ValueError,requests.exceptions.ChunkedEncodingError) as err:
+            if attempt == retries:
+                raise
+            print(f"Retrying {request.query} after {type(err).__name__} (attempt {attempt+1})")
+
+def sync_shard(shard,api_key,session,sink,checkpoint,limit=1000):
+    # pages through one shard from its checkpointed cursor, returns the shard's row count
+    state = checkpoint.get(shard)
+    if state["done"]:
+        return state["rows"]
+    market, ticker_type = shard_filters(shard)
+    cursor, page_num, rows = state["cursor"], state["pages"], state["rows"]
+    while True:
+        request = TickerListRequest(api_key,cursor=cursor,market=market,ticker_type=ticker_type,session=session,limit=limit)
+        table = pa.Table.from_pylist(fetch_page(request),schema=TICKER_SCHEMA)
+        page_num += 1
+        sink.write(shard,page_num,table)
+        cursor = request.get_next_cursor()
+        rows += table.num_rows
+        checkpoint.update(shard,cursor=cursor,pages=page_num,rows=rows,done=cursor is None)
+        print(f"Get tickers {shard} page {page_num}: {rows} tickers")
+        if cursor is None:
+            return rows
+
+def get_ticker_reference(session=None,store=None):
+    # session and store can be shared with other stages (see pipeline.py), returns the failed shards
     # get environment variables
     script_folder = Path(__file__).resolve().parent # can also use os.path.dirname(__file__)
     env_path = os.path.join(script_folder.parent,".env")
     load_dotenv(env_path)
     api_key = os.environ.get("API_KEY")
     data_folder = os.environ.get("DATA_FOLDER")
-    outdir = os.path.join(data_folder,"ticker_json")
+    outdir = os.path.join(data_folder,"ticker_reference")
+    requests_per_minute = float(os.environ.get("REQUESTS_PER_MINUTE",5))
+    max_workers = int(os.environ.get("MAX_WORKERS",4))
+    shards = [shard.strip() for shard in os.environ.get("TICKER_SHARDS",DEFAULT_SHARDS).split(",") if shard.strip()]
+    backend = os.environ.get("STORAGE_BACKEND","sqlite")
+    # the keyed tickers table lives in sqlite, the parquet backends get page files
+    sink_type = os.environ.get("TICKER_SINK") or ("table" if backend == "sqlite" else "parquet")
 
     # make dirs
-    os.makedirs(data_folder,exist_ok=True)
     os.makedirs(outdir,exist_ok=True)
 
-    # initialize variables
-    page_num = 1
-    cursor = None
-    next_page = True
+    own_store = store is None and sink_type == "table"
+    if sink_type == "table":
+        if backend != "sqlite":
+            raise ValueError("TICKER_SINK=table needs the sqlite backend, use TICKER_SINK=parquet")
+        sink = TableSink(get_store(data_folder) if own_store else store)
+    elif sink_type == "parquet":
+        sink = ParquetSink(os.path.join(outdir,"tickers"))
+    else:
+        raise ValueError(f"Unknown ticker sink: {sink_type}")
 
-    # run requests
-    while next_page:
-        print(f"Get tickers page: {page_num}")
-        ticker_request = TickerListRequest(api_key=api_key,page_num=page_num,cursor=cursor,outdir=outdir)
-        cursor = ticker_request.get_next_cursor()
-        page_num += 1
-        if page_num > 1 and cursor is None:
-            print("No more page to query")
-            next_page = False
-        
-        if next_page:
-            time.sleep(13)
-    
-    print("API calls done!")
-
-    json_files = os.listdir(outdir)
-    json_files = [file for file in json_files if "ticker" in file ]
-    json_files = [os.path.join(outdir,file) for file in json_files]
-
-    df = pd.DataFrame()
-    for file in json_files:
-        tmp = pd.read_json(file)
-        df = pd.concat([df,tmp],ignore_index=True)
-    
-    df.to_csv(os.path.join(data_folder,"tickers.csv"),index=False)
+    checkpoint = Checkpoint(os.path.join(outdir,"checkpoint.json"))
+    if checkpoint.exists():
+        print(f"Resuming from {checkpoint.path}")
+        checkpoint.load()
+    else:
+        # a fresh sync replaces the previous reference
+        sink.reset()
+
+    if session is None:
+        session = make_session(requests_per_minute=requests_per_minute,max_workers=max_workers)
+
+    def sync(shard):
+        return sync_shard(shard,api_key,session,sink,checkpoint)
+
+    results = run_jobs(sync,shards,max_workers=max_workers)
+    if own_store:
+        sink.store.close()
+    failed = sorted(shard for shard, rows in results.items() if not isinstance(rows,int))
+    print(f"Synced {sum(rows for rows in results.values() if isinstance(rows,int))} tickers from {len(shards)-len(failed)} of {len(shards)} shards")
+    if failed:
+        print(f"Failed shards: {failed}, rerun to resume from the checkpoint")
+    else:
+        checkpoint.clear()
+        print("API calls done!")
+    return failed
 
 if __name__ == "__main__":
-    get_ticker_json()
+    get_ticker_reference()
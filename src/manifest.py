@@ -0,0 +1,93 @@
+"""
+Manifest of grouped daily files that have already been fetched
+The storage prefix is listed once into memory instead of checking each date. The listing
+can be cached to a file, the cache is only trusted for max_age seconds since other runs
+upload and delete files too
+"""
+import os
+import re
+import json
+import time
+from abc import ABC, abstractmethod
+
+# matches "2023-01-03.json" but not "2023-01-03_full.json"
+DATE_FILE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.\w+$")
+
+
+class Manifest(ABC):
+    def __init__(self,cache_path=None):
+        self.cache_path = cache_path
+        self.blobs = {} # file name -> generation
+        self.dates = set()
+
+    def _set_blobs(self,blobs):
+        self.blobs = dict(blobs)
+        self.dates = set()
+        for name in self.blobs:
+            self._add_date(name)
+
+    def _add_date(self,name):
+        match = DATE_FILE.match(os.path.basename(name))
+        if match:
+            self.dates.add(match.group(1))
+
+    @abstractmethod
+    def _list(self):
+        # file name -> generation of every file under the storage prefix
+        pass
+
+    def cache_fresh(self,max_age):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        return time.time()-os.path.getmtime(self.cache_path) < max_age
+
+    def load(self,refresh=False,max_age=0):
+        # max_age=0 always lists the storage, the cache is then only written for other readers
+        if not refresh and self.cache_fresh(max_age):
+            with open(self.cache_path,"r") as f:
+                self._set_blobs(json.load(f))
+        else:
+            self._set_blobs(self._list())
+            self.save()
+        return self
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path,"w") as f:
+                json.dump(self.blobs,f)
+
+    def exists(self,date):
+        return date in self.dates
+
+    def add(self,name,generation=None):
+        # record a file that just landed
+        self.blobs[name] = generation
+        self._add_date(name)
+
+
+class LocalManifest(Manifest):
+    def __init__(self,folder,cache_path=None):
+        super().__init__(cache_path)
+        self.folder = folder
+
+    def _list(self):
+        # modification time stands in for the object generation
+        return {
+            file: os.stat(os.path.join(self.folder,file)).st_mtime_ns
+            for file in os.listdir(self.folder)
+        }
+
+
+class GCSManifest(Manifest):
+    def __init__(self,bucket_name,prefix="grouped_daily_json/",client=None,cache_path=None):
+        super().__init__(cache_path)
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.client = client
+
+    def _list(self):
+        if self.client is None:
+            from google.cloud import storage
+            self.client = storage.Client()
+        blobs = self.client.list_blobs(self.bucket_name,prefix=self.prefix,fields="items(name,generation),nextPageToken")
+        return {blob.name[len(self.prefix):]: blob.generation for blob in blobs}
@@ -0,0 +1,205 @@
+"""
+Local stand-in for the polygon endpoints the fetch scripts use
+Serves synthetic grouped daily bars and paginated ticker reference pages, with injectable
+latency, 429s and truncated bodies, so fetcher concurrency, retries and rate limiting can
+be measured without spending quota. Point the scripts at it with POLYGON_BASE_URL
+
+Run from src/, e.g.
+    python mock_polygon.py --port 8090 --latency 0.2 --error-rate 0.05 --truncate-rate 0.01
+    POLYGON_BASE_URL=http://127.0.0.1:8090 python get_grouped_daily.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+from trading_calendar import is_trading_day, epoch_day
+
+GROUPED_DAILY_PATH = re.compile(r"^/v2/aggs/grouped/locale/us/market/stocks/(\d{4}-\d{2}-\d{2})$")
+TICKERS_PATH = "/v3/reference/tickers"
+MARKETS = {"stocks":"us","otc":"us","crypto":"global","fx":"global","indices":"us"}
+STOCK_TYPES = ["CS","ETF","ADRC","PFD"]
+MAX_LIMIT = 1000
+
+
+class MockPolygon:
+    def __init__(self,n_tickers=5000,reference_tickers=3000,latency=0.0,jitter=0.0,error_rate=0.0,
+                 truncate_rate=0.0,retry_after=1.0,seed=0):
+        # n_tickers: bars per grouped daily response, reference_tickers: tickers per market
+        self.n_tickers = n_tickers
+        self.reference_tickers = reference_tickers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests":0,"grouped_daily":0,"tickers":0,"rate_limited":0,"truncated":0,"bytes":0}
+
+    def count(self,key,n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def draw(self):
+        # (delay, rate limited, truncated) for one request
+        with self.lock:
+            delay = max(self.latency+self.rng.uniform(-self.jitter,self.jitter),0.0)
+            return delay, self.rng.random() < self.error_rate, self.rng.random() < self.truncate_rate
+
+    def grouped_daily(self,date):
+        day = datetime.date.fromisoformat(date)
+        if not is_trading_day(day):
+            return {"queryCount":0,"resultsCount":0,"adjusted":True,"status":"OK","request_id":f"mock-{date}"}
+        # bars only depend on the date, so a refetch returns the same day
+        rng = np.random.default_rng([self.seed,epoch_day(day)])
+        close = 100*np.exp(rng.normal(0,0.5,self.n_tickers))
+        open_ = close*np.exp(rng.normal(0,0.01,self.n_tickers))
+        high = np.maximum(open_,close)*1.01
+        low = np.minimum(open_,close)*0.99
+        volume = rng.integers(1000,10**7,self.n_tickers)
+        timestamp = int(datetime.datetime(day.year,day.month,day.day,21,tzinfo=datetime.timezone.utc).timestamp()*1000)
+        results = [
+            {"T":f"T{i:05d}","v":float(volume[i]),"vw":round(float(close[i]+open_[i])/2,4),"o":round(float(open_[i]),4),
+             "c":round(float(close[i]),4),"h":round(float(high[i]),4),"l":round(float(low[i]),4),"t":timestamp,"n":int(volume[i]//100)}
+            for i in range(self.n_tickers)
+        ]
+        return {"queryCount":len(results),"resultsCount":len(results),"adjusted":True,"results":results,
+                "status":"OK","request_id":f"mock-{date}","count":len(results)}
+
+    def ticker_page(self,base_url,params):
+        # cursor is "market.type.offset", next_url carries it without the api key like polygon's
+        if "cursor" in params:
+            market, ticker_type, offset = params["cursor"].split(".")
+            offset = int(offset)
+        else:
+            market, ticker_type, offset = params.get("market",""), params.get("type",""), 0
+        limit = min(int(params.get("limit",100)),MAX_LIMIT)
+        universe = [
+            (market_name,i) for market_name in MARKETS if market in ("",market_name)
+            for i in range(self.reference_tickers)
+            if ticker_type in ("",self.ticker_type(market_name,i))
+        ]
+        page = universe[offset:offset+limit]
+        results = [
+            {"ticker":self.ticker_symbol(market_name,i),"name":f"Mock {market_name} {i}","market":market_name,
+             "locale":MARKETS[market_name],"primary_exchange":"XNYS" if market_name == "stocks" else None,
+             "type":self.ticker_type(market_name,i),"active":True,"currency_name":"usd",
+             "cik":f"{i:010d}" if market_name == "stocks" else None,"composite_figi":f"BBG{i:09d}",
+             "share_class_figi":f"BBG{i:09d}","last_updated_utc":"2024-01-02T00:00:00Z"}
+            for market_name, i in page
+        ]
+        data = {"results":results,"status":"OK","request_id":f"mock-{market}-{offset}","count":len(results)}
+        if offset+limit < len(universe):
+            data["next_url"] = f"{base_url}{TICKERS_PATH}?"+urlencode({"cursor":f"{market}.{ticker_type}.{offset+limit}"})
+        return data
+
+    @staticmethod
+    def ticker_type(market,i):
+        return STOCK_TYPES[i%len(STOCK_TYPES)] if market == "stocks" else market.upper()
+
+    @staticmethod
+    def ticker_symbol(market,i):
+        prefix = {"stocks":"S","otc":"O","crypto":"X:C","fx":"C:F","indices":"I:I"}[market]
+        return f"{prefix}{i:05d}"
+
+
+def make_handler(mock):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == "/stats":
+                with mock.lock:
+                    stats = dict(mock.stats)
+                return self._send(200,stats)
+            mock.count("requests")
+            if "apiKey" not in params:
+                return self._send(401,{"status":"ERROR","error":"API Key was not provided"})
+
+            delay, rate_limited, truncated = mock.draw()
+            time.sleep(delay)
+            if rate_limited:
+                mock.count("rate_limited")
+                return self._send(429,{"status":"ERROR","error":"You've exceeded the maximum requests per minute"},
+                                  headers={"Retry-After":str(mock.retry_after)})
+
+            match = GROUPED_DAILY_PATH.match(url.path)
+            if match:
+                mock.count("grouped_daily")
+                body = mock.grouped_daily(match.group(1))
+            elif url.path == TICKERS_PATH:
+                mock.count("tickers")
+                body = mock.ticker_page(f"http://{self.headers.get('Host')}",params)
+            else:
+                return self._send(404,{"status":"NOT_FOUND"})
+            self._send(200,body,truncated=truncated)
+
+        def _send(self,status,body,headers=None,truncated=False):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type","application/json")
+            self.send_header("Content-Length",str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key,value)
+            self.end_headers()
+            if truncated:
+                # the full length is announced but the connection drops halfway
+                mock.count("truncated")
+                payload = payload[:len(payload)//2]
+                self.close_connection = True
+            self.wfile.write(payload)
+            mock.count("bytes",len(payload))
+
+        def log_message(self,format,*args):
+            pass
+
+    return MockHandler
+
+
+def serve(mock,host="127.0.0.1",port=0):
+    # starts the server on a background thread, port 0 picks a free port; returns (server, base url)
+    server = ThreadingHTTPServer((host,port),make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a mock polygon API")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8090)
+    parser.add_argument("--tickers",type=int,default=5000,help="bars per grouped daily response")
+    parser.add_argument("--reference-tickers",type=int,default=3000,help="reference tickers per market")
+    parser.add_argument("--latency",type=float,default=0.0,help="seconds added to every response")
+    parser.add_argument("--jitter",type=float,default=0.0,help="uniform +/- seconds around the latency")
+    parser.add_argument("--error-rate",type=float,default=0.0,help="share of requests answered with 429")
+    parser.add_argument("--truncate-rate",type=float,default=0.0,help="share of responses cut off halfway")
+    parser.add_argument("--retry-after",type=float,default=1.0,help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed",type=int,default=0)
+    args = parser.parse_args()
+
+    mock = MockPolygon(args.tickers,args.reference_tickers,args.latency,args.jitter,args.error_rate,
+                       args.truncate_rate,args.retry_after,args.seed)
+    server, base_url = serve(mock,args.host,args.port)
+    print(f"Mock polygon on {base_url}, set POLYGON_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
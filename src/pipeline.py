@@ -0,0 +1,338 @@
+"""
+Runs the daily stages as a DAG in one process
+Stages share one store, one rate-limited polygon session and one BigQuery client. A stage
+is skipped when the fingerprint of its inputs matches the one recorded after its last
+successful run, stages whose dependencies are finished run concurrently, and every run
+ends with a per-stage timing report
+
+Run from src/, e.g.
+    python pipeline.py
+    python pipeline.py --force --stages etl,forecast
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
+from pathlib import Path
+
+from daily_store import get_store, utc_now
+from fetcher import make_session
+
+
+class Stage:
+    def __init__(self,name,fn,deps=(),fingerprint=None):
+        # fn(context) runs the stage and returns False when it only partly succeeded,
+        # fingerprint(context) describes its inputs, None means always run
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.fingerprint = fingerprint
+
+
+class PipelineContext:
+    # resources shared by the stages, created on first use
+    def __init__(self,data_folder,fake_bigquery=False):
+        self.data_folder = data_folder
+        self.models_folder = os.path.join(data_folder,"models")
+        self.fake_bigquery = fake_bigquery
+        self.lock = threading.Lock()
+        self._store = None
+        self._session = None
+        self._bq_client = None
+
+    @property
+    def store(self):
+        with self.lock:
+            if self._store is None:
+                self._store = get_store(self.data_folder)
+            return self._store
+
+    @property
+    def session(self):
+        # one token bucket for every polygon stage, together they stay under the plan's rate limit
+        with self.lock:
+            if self._session is None:
+                self._session = make_session(
+                    requests_per_minute=float(os.environ.get("REQUESTS_PER_MINUTE",5)),
+                    max_workers=int(os.environ.get("MAX_WORKERS",4)),
+                )
+            return self._session
+
+    @property
+    def bq_client(self):
+        with self.lock:
+            if self._bq_client is None:
+                from bigquery import make_client
+                self._bq_client = make_client(self.fake_bigquery)
+            return self._bq_client
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+        if self._session is not None:
+            self._session.close()
+
+
+class PipelineState:
+    # stage -> fingerprint of its last successful run, rewritten atomically after every stage
+    def __init__(self,path):
+        self.path = path
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path,"r") as f:
+                self.fingerprints = json.load(f)
+        return self
+
+    def unchanged(self,name,fingerprint):
+        return fingerprint is not None and self.fingerprints.get(name) == fingerprint
+
+    def save(self,name,fingerprint):
+        with self.lock:
+            self.fingerprints[name] = fingerprint
+            os.makedirs(os.path.dirname(self.path),exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path,"w") as f:
+                json.dump(self.fingerprints,f)
+            os.replace(tmp_path,self.path)
+
+
+def digest(value):
+    return hashlib.sha256(json.dumps(value,sort_keys=True,default=str).encode()).hexdigest()
+
+def folder_listing(folder):
+    # (name, size, mtime) of every file, enough to notice new or rewritten files without reading them
+    if not os.path.isdir(folder):
+        return []
+    entries = []
+    for file in sorted(os.listdir(folder)):
+        stat = os.stat(os.path.join(folder,file))
+        entries.append((file,stat.st_size,stat.st_mtime_ns))
+    return entries
+
+def config_file(path,ignore=()):
+    # json config contents without the keys a stage writes back itself
+    if not os.path.exists(path):
+        return None
+    with open(path,"r") as f:
+        config = json.load(f)
+    return {key: value for key, value in config.items() if key not in ignore}
+
+
+# stages
+
+def run_fetch_daily(context):
+    from get_grouped_daily import get_grouped_daily
+    # failed dates are retried on the next run, so the fingerprint is not recorded
+    return not get_grouped_daily(session=context.session)
+
+def fetch_daily_fingerprint(context):
+    # new dates only appear when the calendar moves
+    yesterday = datetime.date.today()-datetime.timedelta(days=1)
+    return digest([os.environ.get("START_DATE"),yesterday])
+
+def run_fetch_tickers(context):
+    from get_ticker_reference import get_ticker_reference
+    return not get_ticker_reference(session=context.session,store=context.store)
+
+def fetch_tickers_fingerprint(context):
+    # the reference is refreshed once per TICKER_REFRESH_DAYS window
+    days = int(os.environ.get("TICKER_REFRESH_DAYS",7))
+    return digest([os.environ.get("TICKER_SHARDS"),datetime.date.today().toordinal()//days])
+
+def run_etl(context):
+    import etl_grouped_daily
+    etl_grouped_daily.main(store=context.store)
+
+def etl_fingerprint(context):
+    return digest([os.environ.get("ETL_MODE","incremental"),folder_listing(os.path.join(context.data_folder,"grouped_daily_json"))])
+
+def run_forecast(context):
+    import forecast
+    forecast.main(store=context.store)
+
+def forecast_fingerprint(context):
+    # the etl ledger changes with every new or corrected file, not only when the date range grows;
+    # the trainer writes the watermark back into train_config, it is not an input
+    train_config = config_file(os.path.join(context.models_folder,"train_config.json"),ignore=("watermark",))
+    # on the training weekday the stage runs even without new data, so the weekly retrain happens
+    today = datetime.date.today()
+    training_due = train_config is not None and today.weekday() == train_config.get("train_start")
+    return digest([
+        context.store.loaded_files(context.store.daily_tablename),
+        config_file(os.path.join(context.models_folder,"model_config.json")),
+        train_config,
+        os.environ.get("PUBLISH_MODE","incremental"),
+        today if training_due else None,
+    ])
+
+def run_bigquery(context):
+    import bigquery
+    bigquery.main(client=context.bq_client,store=context.store)
+
+def bigquery_fingerprint(context):
+    return digest([context.store.max_value("small_daily","published_at"),os.environ.get("BQ_WRITE_MODE","merge")])
+
+
+def default_stages(include_tickers=False):
+    # the ticker refresh only shares the rate limiter with the daily fetch, the two run side by side;
+    # etl waits for both since they would otherwise write stock.db at the same time
+    stages = [Stage("fetch_daily",run_fetch_daily,fingerprint=fetch_daily_fingerprint)]
+    etl_deps = ["fetch_daily"]
+    if include_tickers:
+        stages.append(Stage("fetch_tickers",run_fetch_tickers,fingerprint=fetch_tickers_fingerprint))
+        etl_deps.append("fetch_tickers")
+    stages += [
+        Stage("etl",run_etl,etl_deps,etl_fingerprint),
+        Stage("forecast",run_forecast,["etl"],forecast_fingerprint),
+        Stage("bigquery",run_bigquery,["forecast"],bigquery_fingerprint),
+    ]
+    return stages
+
+
+def select_stages(stages,names):
+    selected = set(names)
+    unknown = selected-{stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    # a stage left out counts as done for the ones that depend on it
+    return [Stage(stage.name,stage.fn,[dep for dep in stage.deps if dep in selected],stage.fingerprint)
+            for stage in stages if stage.name in selected]
+
+def find_cycle(stages):
+    # depth-first search over the dependencies, returns the stage names along a cycle or None
+    deps = {stage.name: stage.deps for stage in stages}
+    visiting, done = [], set()
+
+    def visit(name):
+        if name in visiting:
+            return visiting[visiting.index(name):]+[name]
+        if name in done:
+            return None
+        visiting.append(name)
+        for dep in deps.get(name,()):
+            cycle = visit(dep)
+            if cycle:
+                return cycle
+        visiting.pop()
+        done.add(name)
+        return None
+
+    for name in deps:
+        cycle = visit(name)
+        if cycle:
+            return cycle
+    return None
+
+
+def run_pipeline(stages,context,state,force=False,max_workers=2):
+    # returns one report row per stage: status ran/skipped/partial/failed/blocked and timings
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {missing}")
+    cycle = find_cycle(stages)
+    if cycle:
+        raise ValueError(f"Stages depend on each other in a cycle: {' -> '.join(cycle)}")
+    report = {}
+    pending = list(stages)
+    running = {}
+
+    def run(stage):
+        row = {"stage":stage.name,"started_at":utc_now()}
+        start = time.perf_counter()
+        try:
+            fingerprint = stage.fingerprint(context) if stage.fingerprint is not None else None
+            row["fingerprint_seconds"] = time.perf_counter()-start
+            if not force and state.unchanged(stage.name,fingerprint):
+                row["status"] = "skipped"
+            else:
+                complete = stage.fn(context) is not False
+                row["status"] = "ran" if complete else "partial"
+                if complete and fingerprint is not None:
+                    state.save(stage.name,fingerprint)
+        except Exception as err:
+            row["status"] = "failed"
+            row["error"] = f"{type(err).__name__}: {err}"
+            print(f"Stage {stage.name} failed: {row['error']}")
+        row["seconds"] = time.perf_counter()-start
+        return row
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for stage in list(pending):
+                statuses = [report[dep]["status"] if dep in report else None for dep in stage.deps]
+                if any(status in ("failed","blocked") for status in statuses):
+                    report[stage.name] = {"stage":stage.name,"status":"blocked","seconds":0.0}
+                    pending.remove(stage)
+                elif all(status is not None for status in statuses):
+                    print(f"Start stage {stage.name}")
+                    running[executor.submit(run,stage)] = stage
+                    pending.remove(stage)
+            if not running:
+                continue
+            done, _ = wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                report[stage.name] = future.result()
+                print(f"Stage {stage.name} {report[stage.name]['status']} in {report[stage.name]['seconds']:.2f}s")
+    return [report[stage.name] for stage in stages]
+
+
+def print_report(rows,wall_seconds):
+    print(f"{'stage':<14}{'status':<9}{'seconds':>9}")
+    for row in rows:
+        print(f"{row['stage']:<14}{row['status']:<9}{row['seconds']:>9.2f}")
+    print(f"Pipeline took {wall_seconds:.2f}s wall-clock, {sum(row['seconds'] for row in rows):.2f}s in stages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the daily stages in one process")
+    parser.add_argument("--force",action="store_true",help="run stages even if their inputs are unchanged")
+    parser.add_argument("--stages",help="comma separated subset of stages to run, in DAG order")
+    parser.add_argument("--fake-bigquery",action="store_true",help="publish into an in-memory BigQuery client")
+    parser.add_argument("--report",help="file to write the run report as json, default DATA_FOLDER/pipeline_report.json")
+    args = parser.parse_args()
+
+    print("Start pipeline")
+    script_folder = Path(__file__).resolve().parent
+    env_path = os.path.join(script_folder.parent,".env")
+    load_dotenv(env_path)
+    data_folder = os.environ.get("DATA_FOLDER")
+    # the models folder is synced to the bucket between container runs, so the state lives there
+    state_path = os.environ.get("PIPELINE_STATE") or os.path.join(data_folder,"models","pipeline_state.json")
+
+    stages = default_stages(include_tickers=os.environ.get("TICKER_REFRESH","0") == "1")
+    if args.stages:
+        stages = select_stages(stages,args.stages.split(","))
+
+    context = PipelineContext(data_folder,fake_bigquery=args.fake_bigquery)
+    state = PipelineState(state_path).load()
+    start = time.perf_counter()
+    try:
+        rows = run_pipeline(stages,context,state,force=args.force,
+                            max_workers=int(os.environ.get("PIPELINE_WORKERS",2)))
+    finally:
+        context.close()
+    wall_seconds = time.perf_counter()-start
+
+    print_report(rows,wall_seconds)
+    report_path = args.report or os.path.join(data_folder,"pipeline_report.json")
+    with open(report_path,"w") as f:
+        json.dump({"finished_at":utc_now(),"wall_seconds":wall_seconds,"stages":rows},f,indent=2)
+    print("End pipeline")
+    if any(row["status"] in ("failed","blocked") for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
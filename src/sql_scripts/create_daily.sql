@@ -1,14 +1,16 @@
+-- date is stored as days since 1970-01-01, rows are clustered by (ticker,date)
 CREATE TABLE IF NOT EXISTS daily(
-    date TEXT
+    date INTEGER
     , ticker TEXT
-    , open_price 
-    , close_price NUMERIC
-    , highest_price NUMERIC
-    , lowest_price NUMERIC
+    , open_price REAL
+    , close_price REAL
+    , highest_price REAL
+    , lowest_price REAL
     , number_of_transactions INTEGER
     , trading_volume NUMERIC
-    , volume_weighted_average_price NUMERIC
+    , volume_weighted_average_price REAL
     , otc_sticker INTEGER
     , window_start_timestamp INTEGER
-    , PRIMARY KEY (date,ticker)
-)
\ No newline at end of file
+    , PRIMARY KEY (ticker,date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_date_idx ON daily(date);
\ No newline at end of file
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS etl_ledger(
+    file TEXT PRIMARY KEY
+    , tablename TEXT
+    , date TEXT
+    , checksum TEXT
+    , row_count INTEGER
+    , loaded_at TEXT
+)
\ No newline at end of file
@@ -1,7 +1,7 @@
 CREATE TABLE IF NOT EXISTS small_daily(
     date TEXT
     , ticker TEXT
-    , open_price 
+    , open_price NUMERIC
     , close_price NUMERIC
     , highest_price NUMERIC
     , lowest_price NUMERIC
@@ -10,5 +10,9 @@ CREATE TABLE IF NOT EXISTS small_daily(
     , volume_weighted_average_price NUMERIC
     , otc_sticker INTEGER
     , window_start_timestamp INTEGER
-    , PRIMARY KEY (date,ticker)
-)
\ No newline at end of file
+    , run_id TEXT
+    , published_at TEXT
+    , PRIMARY KEY (date,ticker,run_id)
+);
+CREATE INDEX IF NOT EXISTS small_daily_run_idx ON small_daily(run_id,date);
+CREATE INDEX IF NOT EXISTS small_daily_published_idx ON small_daily(published_at);
@@ -0,0 +1,16 @@
+-- runs after the old table is renamed to daily_old and create_daily.sql has run
+INSERT OR REPLACE INTO daily
+SELECT
+    CAST(julianday(date) - 2440587.5 AS INTEGER)
+    , ticker
+    , CAST(open_price AS REAL)
+    , CAST(close_price AS REAL)
+    , CAST(highest_price AS REAL)
+    , CAST(lowest_price AS REAL)
+    , number_of_transactions
+    , trading_volume
+    , CAST(volume_weighted_average_price AS REAL)
+    , otc_sticker
+    , window_start_timestamp
+FROM daily_old;
+DROP TABLE daily_old;
\ No newline at end of file
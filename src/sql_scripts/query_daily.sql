@@ -1,3 +0,0 @@
-SELECT *
-FROM daily
-WHERE ticker in ("META","AMZN","NFLX","GOOG","AAPL")
\ No newline at end of file
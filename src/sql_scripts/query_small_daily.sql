@@ -1,2 +0,0 @@
-SELECT *
-FROM small_daily
\ No newline at end of file
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from forecasting.backtest import backtest, make_folds, run_fold, synthetic_daily
+from forecasting.data_prep import apply_missing_policy, pivot_close
+from trading_calendar import next_trading_days
+
+
+def late_listed_daily(late_days=30):
+    # SYN0 has no closes for its first late_days trading days
+    df = synthetic_daily(n_tickers=3,n_days=160,seed=1)
+    dates = sorted(df["date"].unique())
+    return df[~((df["ticker"] == "SYN0") & (df["date"] < dates[late_days]))].reset_index(drop=True), dates[late_days]
+
+
+def test_backtest_late_listed_ticker():
+    df, listed = late_listed_daily()
+    summary, timings, _ = backtest(df,{"hidden_size":4},window_size=5,horizon=3,n_folds=2,test_size=10,epochs=1,batch_size=16)
+    assert len(timings) == 2
+    assert (summary["n"] == 2*10).all()
+    assert (timings["train_start"] >= listed).all()
+
+
+def test_run_fold_evaluates_the_right_dates():
+    df, _ = late_listed_daily()
+    dates = apply_missing_policy(pivot_close(df),"ffill").index.tolist()
+    horizon = 3
+    fold = make_folds(len(dates),1,10,5,horizon)[0]
+    errors, _ = run_fold(df,dates,fold,{"hidden_size":4},5,horizon,10,1,16)
+
+    closes = pivot_close(df)
+    assert errors["origin_date"].iloc[0] == dates[fold[1]-1]
+    for row in errors.sample(20,random_state=0).itertuples():
+        target = next_trading_days(row.origin_date,row.horizon)[-1].isoformat()
+        assert np.isclose(row.actual,closes.loc[target,row.ticker])
+
+
+def test_make_folds_rolling():
+    folds = make_folds(200,2,20,10,5,mode="rolling")
+    assert folds == [(0,156),(0,176)]
+    assert make_folds(200,2,20,10,5,mode="rolling",train_size=100) == [(56,156),(76,176)]
+    with pytest.raises(ValueError):
+        make_folds(200,2,20,10,5,mode="rolling",train_size=None)
@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+
+import bigquery
+from daily_store import SQLiteStore
+from fake_bigquery import FakeClient
+
+SCHEMA_PATH = os.path.join(os.path.dirname(bigquery.__file__),"bq_schemas","small_daily.json")
+TABLE_ID = "fake-project.stock_dataset.small_daily"
+
+
+def rows(dates,run_id,close,published_at):
+    return pd.DataFrame({
+        "date":dates,
+        "ticker":"AAA",
+        "close_price":close,
+        "run_id":run_id,
+        "published_at":published_at,
+    })
+
+
+def published(client):
+    df = client.get_table(TABLE_ID).data.to_pandas()
+    return df.sort_values(["date","run_id"],ignore_index=True)
+
+
+def publish_twice(tmp_path,write_mode):
+    # the second publish has one new day and a corrected close for a day that was already published
+    store = SQLiteStore(str(tmp_path/"stock.db"))
+    client = FakeClient()
+    store.upsert_table("small_daily",rows(["2024-01-02","2024-01-03"],"actual",[1.0,2.0],"2024-01-04T00:00:00+00:00"),bigquery.KEY_COLS)
+    assert bigquery.publish(client,store,TABLE_ID,SCHEMA_PATH,str(tmp_path),write_mode=write_mode) == 2
+    store.upsert_table("small_daily",rows(["2024-01-03","2024-01-04"],"actual",[2.5,3.0],"2024-01-05T00:00:00+00:00"),bigquery.KEY_COLS)
+    shipped = bigquery.publish(client,store,TABLE_ID,SCHEMA_PATH,str(tmp_path),write_mode=write_mode)
+    store.close()
+    return shipped, published(client), client
+
+
+def test_publish_merge(tmp_path):
+    shipped, df, client = publish_twice(tmp_path,"merge")
+    assert shipped == 2
+    assert len(df) == 3
+    assert not df.duplicated(subset=bigquery.KEY_COLS).any()
+    assert df["close_price"].tolist() == [1.0,2.5,3.0]
+    # the staging table is dropped after the merge
+    assert list(client.tables) == [TABLE_ID]
+    assert "small_daily_staging.parquet" not in os.listdir(tmp_path)
+
+
+def test_publish_append(tmp_path):
+    shipped, df, _ = publish_twice(tmp_path,"append")
+    assert shipped == 2
+    # append only ships the new rows, the corrected day is there twice
+    assert len(df) == 4
+    assert df.duplicated(subset=bigquery.KEY_COLS).sum() == 1
+
+
+def test_publish_truncate(tmp_path):
+    shipped, df, _ = publish_twice(tmp_path,"truncate")
+    assert shipped == 3
+    assert len(df) == 3
+    assert df["close_price"].tolist() == [1.0,2.5,3.0]
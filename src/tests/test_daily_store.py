@@ -0,0 +1,82 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from daily_store import DailyStore, get_store
+from trading_calendar import epoch_day
+
+
+def daily_file(date,closes,checksum):
+    # one decoded grouped daily file as the etl hands it to the store
+    tickers = sorted(closes)
+    table = pa.table({
+        "ticker":tickers,
+        "close_price":[closes[ticker] for ticker in tickers],
+        "date":pa.array([epoch_day(date)]*len(tickers),pa.int32()),
+    })
+    return f"/data/grouped_daily_json/{date}.parquet", checksum, date, table
+
+
+@pytest.fixture(params=["sqlite","parquet","duckdb"])
+def store(request,tmp_path):
+    store = get_store(str(tmp_path),backend=request.param)
+    store.create_table("create_daily.sql")
+    yield store
+    store.close()
+
+
+def test_daily_round_trip(store):
+    assert store.daily_bounds() == (None,None)
+    store.load("daily",[
+        daily_file("2024-01-02",{"AAA":1.0,"BBB":2.0},"a"),
+        daily_file("2024-01-03",{"AAA":1.5,"BBB":2.5},"b"),
+        # a holiday file with no bars is recorded but leaves no rows behind
+        daily_file("2024-01-04",{},"c"),
+    ],["ticker","date"])
+    # a corrected file replaces its day's rows instead of duplicating them
+    store.load("daily",[daily_file("2024-01-03",{"AAA":1.6,"BBB":2.5},"b2")],["ticker","date"])
+
+    assert store.loaded_files("daily") == {"2024-01-02.parquet":"a","2024-01-03.parquet":"b2","2024-01-04.parquet":"c"}
+    assert store.daily_bounds() == ("2024-01-02","2024-01-03")
+    df = store.read_daily(columns=["date","ticker","close_price"]).sort_values(["date","ticker"],ignore_index=True)
+    assert df["date"].astype(str).tolist() == ["2024-01-02","2024-01-02","2024-01-03","2024-01-03"]
+    assert df["close_price"].tolist() == [1.0,2.0,1.6,2.5]
+    batches = list(store.iter_daily(tickers=["AAA"],start="2024-01-03",columns=["date","ticker","close_price"]))
+    assert sum(batch.num_rows for batch in batches) == 1
+    assert batches[0].schema.field("date").type == pa.date32()
+
+
+def test_upsert_and_max_value(store):
+    keys = ["date","ticker","run_id"]
+    assert store.max_value("small_daily","date") is None
+    store.upsert_table("small_daily",pd.DataFrame({
+        "date":["2024-01-02","2024-01-03","2024-01-04"],
+        "ticker":"AAA",
+        "close_price":[1.0,2.0,3.0],
+        "run_id":["actual","actual","2024-01-03"],
+    }),keys)
+    store.upsert_table("small_daily",pd.DataFrame({
+        "date":["2024-01-03","2024-01-05"],
+        "ticker":"AAA",
+        "close_price":[2.5,4.0],
+        "run_id":["actual","2024-01-03"],
+    }),keys)
+
+    df = store.read_table("small_daily").sort_values(["date"],ignore_index=True)
+    assert len(df) == 4
+    assert df["close_price"].tolist() == [1.0,2.5,3.0,4.0]
+    assert store.max_value("small_daily","date") == "2024-01-05"
+    assert store.max_value("small_daily","date",[("run_id","=","actual")]) == "2024-01-03"
+    assert store.max_value("small_daily","published_at") is None
+
+    store.upsert_table("small_daily",df.iloc[:1],keys,replace=True)
+    assert len(store.read_table("small_daily")) == 1
+
+
+def test_incomplete_backend_fails_on_creation():
+    class PartialStore(DailyStore):
+        def loaded_files(self,tablename):
+            return {}
+
+    with pytest.raises(TypeError):
+        PartialStore()
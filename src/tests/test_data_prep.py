@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from forecasting.data_prep import DataPrep, update_tickers_config
+
+
+def close_frame():
+    # date x ticker closes with gaps, BBB has no close on the first day after the watermark
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2024-01-01",periods=40).strftime("%Y-%m-%d")
+    values = 100*np.exp(np.cumsum(rng.normal(0,0.02,size=(40,3)),axis=0))
+    frame = pd.DataFrame(values,index=pd.Index(dates,name="date"),columns=pd.Index(["AAA","BBB","CCC"],name="ticker"))
+    frame.iloc[5,0] = np.nan
+    frame.iloc[30,1] = np.nan
+    frame.iloc[31,1] = np.nan
+    return frame
+
+
+@pytest.mark.parametrize("missing",["ffill","drop","mask"])
+def test_incremental_stats_match_full_recompute(missing):
+    frame = close_frame()
+    watermark = frame.index[29]
+    saved = DataPrep(frame.loc[:watermark],5,missing=missing).tickers_config
+    updated = update_tickers_config(saved,frame,since=watermark,missing=missing)
+    full = DataPrep(frame,5,missing=missing).tickers_config
+    for ticker in full:
+        assert updated[ticker]["count"] == full[ticker]["count"]
+        assert updated[ticker]["mean"] == pytest.approx(full[ticker]["mean"],rel=1e-12)
+        assert updated[ticker]["std"] == pytest.approx(full[ticker]["std"],rel=1e-12)
+
+
+def test_float32_frame_keeps_float64_stats():
+    frame = close_frame()
+    frame32 = frame.astype("float32")
+    # the baseline is the same float32 closes, accumulated in float64
+    baseline = frame32.astype("float64").ffill().dropna()
+    config = DataPrep(frame32,5).tickers_config
+    for ticker in frame.columns:
+        assert config[ticker]["mean"] == pytest.approx(baseline[ticker].mean(),rel=1e-14)
+        assert config[ticker]["std"] == pytest.approx(baseline[ticker].std(),rel=1e-14)
+    dataset = DataPrep(frame32,5)
+    assert dataset.data.dtype == dataset.data_normalized.dtype == torch.float32
+
+
+def test_window_loader_matches_dataloader():
+    from torch.utils.data import DataLoader
+    dataset = DataPrep(close_frame(),5)
+    torch.manual_seed(0)
+    expected = [[targets for _, targets in DataLoader(dataset,batch_size=8,shuffle=True)] for _ in range(2)]
+    torch.manual_seed(0)
+    batches = [[targets for _, targets in dataset.get_loader(batch_size=8)] for _ in range(2)]
+    assert len(batches[0]) == len(expected[0])
+    for epoch, expected_epoch in zip(batches,expected):
+        for targets, expected_targets in zip(epoch,expected_epoch):
+            assert torch.equal(targets,expected_targets)
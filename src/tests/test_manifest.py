@@ -0,0 +1,48 @@
+import os
+import time
+
+import pytest
+
+from manifest import LocalManifest, Manifest
+
+
+def touch(folder,name):
+    with open(os.path.join(folder,name),"w") as f:
+        f.write("{}")
+
+
+def test_local_manifest_lists_dates(tmp_path):
+    touch(tmp_path,"2024-01-02.parquet")
+    touch(tmp_path,"2024-01-03.json")
+    touch(tmp_path,"2024-01-04_full.json")
+    manifest = LocalManifest(str(tmp_path)).load()
+    assert manifest.dates == {"2024-01-02","2024-01-03"}
+    assert manifest.exists("2024-01-02")
+    assert not manifest.exists("2024-01-04")
+
+    manifest.add("2024-01-05.parquet")
+    assert manifest.exists("2024-01-05")
+
+
+def test_local_manifest_cache(tmp_path):
+    folder = tmp_path/"grouped_daily_json"
+    folder.mkdir()
+    cache_path = str(tmp_path/"manifest.json")
+    touch(folder,"2024-01-02.parquet")
+    LocalManifest(str(folder),cache_path=cache_path).load()
+    assert os.path.exists(cache_path)
+
+    # another run uploads a date and deletes one
+    touch(folder,"2024-01-03.parquet")
+    os.remove(folder/"2024-01-02.parquet")
+    cached = LocalManifest(str(folder),cache_path=cache_path).load(max_age=3600)
+    assert cached.dates == {"2024-01-02"}
+    # a stale cache and the default max_age list the folder again
+    os.utime(cache_path,(time.time()-7200,time.time()-7200))
+    assert LocalManifest(str(folder),cache_path=cache_path).load(max_age=3600).dates == {"2024-01-03"}
+    assert LocalManifest(str(folder),cache_path=cache_path).load().dates == {"2024-01-03"}
+
+
+def test_manifest_is_abstract():
+    with pytest.raises(TypeError):
+        Manifest()
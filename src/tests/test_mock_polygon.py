@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from api_models import GroupedDailyRequest, TickerListRequest
+from daily_files import read_grouped_daily
+from fetcher import make_session
+from get_ticker_reference import Checkpoint, ParquetSink, sync_shard
+from mock_polygon import MockPolygon, serve
+
+
+@pytest.fixture
+def polygon(monkeypatch):
+    # retry_after keeps the injected 429s cheap, the seed makes the faults the same on every run
+    mock = MockPolygon(n_tickers=50,reference_tickers=450,error_rate=0.3,truncate_rate=0.2,retry_after=0.01,seed=1)
+    server, base_url = serve(mock)
+    monkeypatch.setenv("POLYGON_BASE_URL",base_url)
+    yield mock, base_url
+    server.shutdown()
+    server.server_close()
+
+
+def session():
+    return make_session(requests_per_minute=60000,max_workers=1,max_retries=20)
+
+
+def test_requests_use_the_env_url(polygon):
+    _, base_url = polygon
+    request = TickerListRequest("key",market="stocks")
+    assert request.query == f"{base_url}/v3/reference/tickers"
+    assert TickerListRequest("key",endpoint="http://other/").query == "http://other/v3/reference/tickers"
+
+
+def test_grouped_daily_absorbs_rate_limits(polygon,tmp_path):
+    mock, base_url = polygon
+    # grouped daily bodies are not re-read, a truncated day is retried on the next run
+    mock.truncate_rate = 0.0
+    mock.error_rate = 0.6
+    dates = ["2024-01-02","2024-01-03","2024-01-04","2024-01-05"]
+    requests = [GroupedDailyRequest(date,"key",str(tmp_path),session=session()) for date in dates]
+    assert all(request.ok for request in requests)
+    assert all(request.query.startswith(base_url) for request in requests)
+    assert len(read_grouped_daily(requests[0].path)) == 50
+    assert mock.stats["grouped_daily"] == len(dates)
+    assert mock.stats["rate_limited"] > 0
+
+
+def test_ticker_pages_absorb_rate_limits_and_truncation(polygon,tmp_path):
+    mock, _ = polygon
+    sink = ParquetSink(str(tmp_path/"tickers"))
+    sink.reset()
+    checkpoint = Checkpoint(str(tmp_path/"checkpoint.json"))
+    rows = sync_shard("stocks","key",session(),sink,checkpoint,limit=50)
+    assert rows == 450
+    assert len(os.listdir(tmp_path/"tickers")) == 9
+    assert checkpoint.get("stocks")["done"]
+    assert mock.stats["rate_limited"] > 0
+    assert mock.stats["truncated"] > 0
@@ -0,0 +1,74 @@
+import pytest
+
+from pipeline import PipelineState, Stage, run_pipeline, select_stages
+
+
+def run(stages,tmp_path,force=False):
+    state = PipelineState(str(tmp_path/"state.json")).load()
+    rows = run_pipeline(stages,None,state,force=force)
+    return {row["stage"]: row["status"] for row in rows}, state
+
+
+def recorder(calls,name,result=None):
+    def fn(context):
+        calls.append(name)
+        if isinstance(result,Exception):
+            raise result
+        return result
+    return fn
+
+
+def test_unchanged_fingerprint_skips(tmp_path):
+    calls = []
+    fingerprint = {"value":"a"}
+    stages = [Stage("a",recorder(calls,"a"),fingerprint=lambda context: fingerprint["value"])]
+    assert run(stages,tmp_path)[0] == {"a":"ran"}
+    assert run(stages,tmp_path)[0] == {"a":"skipped"}
+    assert run(stages,tmp_path,force=True)[0] == {"a":"ran"}
+    fingerprint["value"] = "b"
+    assert run(stages,tmp_path)[0] == {"a":"ran"}
+    assert calls == ["a","a","a"]
+
+
+def test_partial_is_not_recorded(tmp_path):
+    calls = []
+    stages = [Stage("a",recorder(calls,"a",False),fingerprint=lambda context: "a")]
+    statuses, state = run(stages,tmp_path)
+    assert statuses == {"a":"partial"}
+    assert "a" not in state.fingerprints
+    assert run(stages,tmp_path)[0] == {"a":"partial"}
+    assert calls == ["a","a"]
+
+
+def test_failed_stage_blocks_dependents(tmp_path):
+    calls = []
+    stages = [
+        Stage("a",recorder(calls,"a",RuntimeError("boom"))),
+        Stage("b",recorder(calls,"b"),["a"]),
+        Stage("c",recorder(calls,"c"),["b"]),
+        Stage("d",recorder(calls,"d")),
+    ]
+    statuses, _ = run(stages,tmp_path)
+    assert statuses == {"a":"failed","b":"blocked","c":"blocked","d":"ran"}
+    assert sorted(calls) == ["a","d"]
+
+
+def test_cycle_raises(tmp_path):
+    stages = [Stage("a",recorder([],"a"),["b"]),Stage("b",recorder([],"b"),["a"])]
+    with pytest.raises(ValueError,match="cycle"):
+        run(stages,tmp_path)
+
+
+def test_select_stages_prunes_dependencies(tmp_path):
+    calls = []
+    stages = [
+        Stage("a",recorder(calls,"a")),
+        Stage("b",recorder(calls,"b"),["a"]),
+        Stage("c",recorder(calls,"c"),["b"]),
+    ]
+    selected = select_stages(stages,["b","c"])
+    assert [(stage.name,stage.deps) for stage in selected] == [("b",[]),("c",["b"])]
+    assert run(selected,tmp_path)[0] == {"b":"ran","c":"ran"}
+    assert calls == ["b","c"]
+    with pytest.raises(ValueError):
+        select_stages(stages,["x"])
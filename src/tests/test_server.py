@@ -0,0 +1,128 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import forecast
+from daily_store import get_store
+from forecasting.server import ForecastService
+from trading_calendar import epoch_day, next_trading_days
+
+TICKERS = ["AAA","BBB","CCC"]
+
+
+def load_days(store,days,seed=0):
+    rng = np.random.default_rng(seed)
+    store.load("daily",[
+        (f"{day}.parquet","checksum",day,pa.table({
+            "ticker":TICKERS,
+            "close_price":100*np.exp(rng.normal(0,0.02,len(TICKERS))),
+            "date":pa.array([epoch_day(day)]*len(TICKERS),pa.int32()),
+        }))
+        for day in days
+    ],["ticker","date"])
+
+
+def train(data_folder,store):
+    models_folder = os.path.join(data_folder,"models")
+    train_config_path = os.path.join(models_folder,"train_config.json")
+    with open(train_config_path) as f:
+        tickers, start = forecast.universe(json.load(f))
+    forecast.trainer(forecast.load_db_data(store,tickers,start=start),os.path.join(models_folder,"model_config.json"),
+                     os.path.join(models_folder,"model.pt"),models_folder,train_config_path)
+
+
+@pytest.fixture
+def data_folder(tmp_path,monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND","sqlite")
+    days = [day.isoformat() for day in next_trading_days(datetime.date(2024,1,1),40)]
+    models_folder = tmp_path/"models"
+    models_folder.mkdir()
+    with open(models_folder/"model_config.json","w") as f:
+        json.dump({"input_size":len(TICKERS),"hidden_size":4},f)
+    with open(models_folder/"train_config.json","w") as f:
+        json.dump({"train_start":datetime.date.today().weekday(),"window_size":5,"epochs":1,"train_mode":"full",
+                   "tickers":TICKERS,"export":False},f)
+    store = get_store(str(tmp_path))
+    store.create_table("create_daily.sql")
+    load_days(store,days[:-1])
+    train(str(tmp_path),store)
+    store.close()
+    return str(tmp_path), days
+
+
+@pytest.fixture
+def service(data_folder):
+    service = ForecastService(data_folder[0],max_wait=0.2,poll_interval=0.05).start()
+    yield service
+    service.stop()
+
+
+def counting(state):
+    # counts the forecast passes of a state's model
+    calls = []
+    model_forecast = state.model.forecast
+    def forecast(*args,**kwargs):
+        calls.append(args[0].shape[0])
+        return model_forecast(*args,**kwargs)
+    state.model.forecast = forecast
+    return calls
+
+
+def wait_for(condition,timeout=10):
+    deadline = time.monotonic()+timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+def test_concurrent_requests_share_a_pass_and_the_cache(service):
+    calls = counting(service.state)
+    results = {}
+    def request(ticker,as_of):
+        results[(ticker,as_of)] = service.forecast([ticker],horizon=3,as_of=as_of)
+    threads = [threading.Thread(target=request,args=(ticker,as_of)) for ticker in TICKERS for as_of in ("2024-02-01","2024-02-02")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # six requests over two origins are answered by one pass of two windows
+    assert calls == [2]
+    assert len(results[("AAA","2024-02-01")]["forecast"]["AAA"]) == 3
+    # every ticker of both origins is cached now
+    service.forecast(TICKERS,horizon=3,as_of="2024-02-01")
+    assert calls == [2]
+    assert service.health()["cache_entries"] == 2*len(TICKERS)
+
+
+def test_new_days_refresh_the_data_not_the_model(service,data_folder):
+    folder, days = data_folder
+    state = service.state
+    service.forecast(["AAA"],horizon=2)
+    store = get_store(folder)
+    load_days(store,days[-1:],seed=1)
+    store.close()
+    wait_for(lambda: service.state.dataset.data_index[-1] == days[-1])
+    assert service.state.model is state.model
+    assert service.state.version == state.version
+    assert service.health()["cache_entries"] == 0
+
+
+def test_reload_waits_for_the_marker(service,data_folder):
+    folder, _ = data_folder
+    models_folder = os.path.join(folder,"models")
+    state = service.state
+    # model files of a training in progress are not picked up
+    os.utime(os.path.join(models_folder,"model.pt"))
+    os.utime(os.path.join(models_folder,"tickers_config.json"))
+    time.sleep(0.3)
+    assert service.state is state
+    os.utime(os.path.join(models_folder,forecast.MODEL_MARKER))
+    wait_for(lambda: service.state.version != state.version)
+    assert service.state.model is not state.model
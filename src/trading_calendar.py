@@ -0,0 +1,151 @@
+"""
+NYSE trading calendar computed locally from the exchange's holiday rules
+Used to skip days that can never have data before any request or file read
+"""
+import datetime
+from functools import lru_cache
+
+# one-off closures that don't follow the yearly rules
+SPECIAL_CLOSURES = {
+    datetime.date(2001,9,11), datetime.date(2001,9,12), datetime.date(2001,9,13), datetime.date(2001,9,14), # 9/11
+    datetime.date(2004,6,11),   # Reagan funeral
+    datetime.date(2007,1,2),    # Ford funeral
+    datetime.date(2012,10,29), datetime.date(2012,10,30), # Hurricane Sandy
+    datetime.date(2018,12,5),   # G.H.W. Bush funeral
+    datetime.date(2025,1,9),    # Carter funeral
+}
+
+
+def to_date(day):
+    # accept date, datetime, pandas Timestamp or "YYYY-MM-DD"
+    if isinstance(day,str):
+        return datetime.date.fromisoformat(day)
+    if isinstance(day,datetime.datetime):
+        return day.date()
+    return day
+
+
+EPOCH = datetime.date(1970,1,1)
+
+
+def epoch_day(day):
+    # integer day number used as the date key of the daily table
+    return (to_date(day)-EPOCH).days
+
+
+def from_epoch_day(n):
+    return EPOCH + datetime.timedelta(days=int(n))
+
+
+def easter(year):
+    # anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year,100)
+    d, e = divmod(b,4)
+    f = (b+8)//25
+    g = (b-f+1)//3
+    h = (19*a+b-d-g+15) % 30
+    i, k = divmod(c,4)
+    l = (32+2*e+2*i-h-k) % 7
+    m = (a+11*h+22*l)//451
+    month, day = divmod(h+l-7*m+114,31)
+    return datetime.date(year,month,day+1)
+
+
+def nth_weekday(year,month,weekday,n):
+    # n-th given weekday of the month, n=-1 for the last one
+    if n > 0:
+        day = datetime.date(year,month,1)
+        day += datetime.timedelta(days=(weekday-day.weekday()) % 7)
+        return day + datetime.timedelta(weeks=n-1)
+    next_month = datetime.date(year+month//12,month % 12+1,1)
+    day = next_month - datetime.timedelta(days=1)
+    return day - datetime.timedelta(days=(day.weekday()-weekday) % 7)
+
+
+def observed(day):
+    # Saturday holidays move to Friday, Sunday holidays to Monday
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    days = set()
+    # NYSE does not close on Dec 31 when New Year's Day falls on a Saturday
+    new_year = datetime.date(year,1,1)
+    if new_year.weekday() != 5:
+        days.add(observed(new_year))
+    if year >= 1998:
+        days.add(nth_weekday(year,1,0,3))   # Martin Luther King Jr. Day
+    days.add(nth_weekday(year,2,0,3))       # Washington's Birthday
+    days.add(easter(year)-datetime.timedelta(days=2)) # Good Friday
+    days.add(nth_weekday(year,5,0,-1))      # Memorial Day
+    if year >= 2022:
+        days.add(observed(datetime.date(year,6,19))) # Juneteenth
+    days.add(observed(datetime.date(year,7,4)))
+    days.add(nth_weekday(year,9,0,1))       # Labor Day
+    days.add(nth_weekday(year,11,3,4))      # Thanksgiving
+    days.add(observed(datetime.date(year,12,25)))
+    days.update(day for day in SPECIAL_CLOSURES if day.year == year)
+    return frozenset(day for day in days if day.year == year)
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    # 1pm closes: day before Independence Day, day after Thanksgiving, Christmas Eve
+    days = set()
+    july_3 = datetime.date(year,7,3)
+    if july_3.weekday() <= 3:
+        days.add(july_3)
+    days.add(nth_weekday(year,11,3,4)+datetime.timedelta(days=1))
+    christmas_eve = datetime.date(year,12,24)
+    if christmas_eve.weekday() <= 3:
+        days.add(christmas_eve)
+    return frozenset(day for day in days if is_trading_day(day))
+
+
+def is_trading_day(day):
+    day = to_date(day)
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def is_early_close(day):
+    day = to_date(day)
+    return day in early_closes(day.year)
+
+
+def trading_days(start,end):
+    # trading days in [start, end]
+    day, end = to_date(start), to_date(end)
+    days = []
+    while day <= end:
+        if is_trading_day(day):
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def next_trading_days(day,n):
+    # the n trading days strictly after day
+    day = to_date(day)
+    days = []
+    while len(days) < n:
+        day += datetime.timedelta(days=1)
+        if is_trading_day(day):
+            days.append(day)
+    return days
+
+
+def previous_trading_days(day,n):
+    # the n trading days up to and including day, oldest first
+    day = to_date(day)
+    days = []
+    while len(days) < n:
+        if is_trading_day(day):
+            days.append(day)
+        day -= datetime.timedelta(days=1)
+    return days[::-1]